@@ -1,6 +1,9 @@
+import json
+import os
 from datetime import date
 from sqlalchemy import func
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, Response
 from sqlalchemy.orm import Session
 
 from backend.schemas import DashboardStats
@@ -10,6 +13,10 @@ from models import Garden, Prediction, VegetationCycle
 Base.metadata.create_all(bind=engine)
 app = FastAPI(title="Garden")
 
+# XYZ tiles from segmentation/lib/tiles.py: TILES_DIR/<scene>/<layer>/<z>/<x>/<y>.png
+TILES_DIR = os.path.realpath(os.environ.get("TILES_DIR", "tiles"))
+TILE_CACHE_CONTROL = "public, max-age=86400"
+
 
 @app.get("/")
 def main():
@@ -75,3 +82,30 @@ async def get_dashboard_stats(db: Session = Depends(get_db)):
         low_productivity_count=zones_dict.get('low', 0),
         active_alerts_count=active_alerts
     )
+
+
+@app.get("/tiles/{scene}/{layer}/{z}/{x}/{y}.png")
+def get_tile(scene: str, layer: str, z: int, x: int, y: int, request: Request):
+    path = os.path.realpath(os.path.join(TILES_DIR, scene, layer, str(z), str(x), f"{y}.png"))
+    if not path.startswith(TILES_DIR + os.sep) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {"Cache-Control": TILE_CACHE_CONTROL, "ETag": etag}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/png", headers=headers)
+
+
+@app.get("/tiles/{scene}/{layer}/tiles.json")
+def get_tilejson(scene: str, layer: str, request: Request):
+    path = os.path.realpath(os.path.join(TILES_DIR, scene, layer, "tiles.json"))
+    if not path.startswith(TILES_DIR + os.sep) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Tileset not found")
+
+    with open(path, encoding="utf-8") as f:
+        tilejson = json.load(f)
+    tilejson["tiles"] = [f"{str(request.base_url).rstrip('/')}/tiles/{scene}/{layer}/{{z}}/{{x}}/{{y}}.png"]
+    return tilejson
@@ -0,0 +1,7 @@
+-- VegetationCycle.date was declared as None and never created.
+-- Base.metadata.create_all does not add columns to an existing table, so
+-- databases created before it need this once:
+--   psql "$DATABASE_URL" -f backend/migrations/0001_vegetation_cycles_date.sql
+
+ALTER TABLE vegetation_cycles ADD COLUMN IF NOT EXISTS date DATE;
+CREATE INDEX IF NOT EXISTS ix_vegetation_cycles_date ON vegetation_cycles (date);
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Integer, Column, String, JSON, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Integer, Column, String, JSON, Float, Date, DateTime, ForeignKey, Boolean
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -34,7 +34,8 @@ class VegetationCycle(Base):
     __tablename__ = "vegetation_cycles"
     id = Column(Integer, primary_key=True, index=True)
     garden_id = Column(Integer, ForeignKey("gardens.id"), index=True)
-    date = None
+    # Existing databases: backend/migrations/0001_vegetation_cycles_date.sql
+    date = Column(Date, index=True)
 
     ndvi = Column(Float)
     evi = Column(Float)
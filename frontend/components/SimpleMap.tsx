@@ -5,6 +5,8 @@ import Map, { Layer, Source } from 'react-map-gl';
 import 'mapbox-gl/dist/mapbox-gl.css';
 
 const MAPBOX_TOKEN = 'ваш_публичный_токен';
+const API_URL = process.env.NEXT_PUBLIC_API_URL ?? 'http://localhost:8000';
+const SCENE = 'voronezh';
 
 const mockGarden = {
     type: 'Feature',
@@ -36,6 +38,22 @@ export default function SimpleMap() {
             style={{ width: '100%', height: 400 }}
             attributionControl={false}
         >
+            <Source
+                id="scene"
+                type="raster"
+                tiles={[`${API_URL}/tiles/${SCENE}/rgb/{z}/{x}/{y}.png`]}
+                tileSize={256}
+            >
+                <Layer id="scene-rgb" type="raster" />
+            </Source>
+            <Source
+                id="crops"
+                type="raster"
+                tiles={[`${API_URL}/tiles/${SCENE}/crops/{z}/{x}/{y}.png`]}
+                tileSize={256}
+            >
+                <Layer id="crops-overlay" type="raster" />
+            </Source>
             <Source id="garden" type="geojson" data={mockGarden}>
                 <Layer
                     id="garden-fill"
@@ -0,0 +1,70 @@
+import torch
+import segmentation_models_pytorch as smp
+
+
+BACKENDS = ('eager', 'torchscript', 'onnx')
+
+
+def load_model(model_path, device):
+    model = smp.Unet(encoder_name="resnet34", encoder_weights=None, classes=1,
+                     activation='sigmoid')
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.to(device)
+    model.eval()
+    return model
+
+
+class OnnxModel:
+    """ONNX Runtime session with the call signature of the torch model.
+
+    Takes a (N, 3, H, W) tensor and returns a (N, 1, H, W) tensor, so it
+    can replace the U-Net anywhere ``predict_batch`` is used.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Graphs exported before height/width were dynamic have fixed int dims.
+        self.patch_shape = tuple(dim if isinstance(dim, int) else None for dim in model_input.shape[2:])
+
+    def __call__(self, batch):
+        size = tuple(batch.shape[2:])
+        if any(fixed is not None and fixed != actual for fixed, actual in zip(self.patch_shape, size)):
+            raise ValueError(f"ONNX model expects {self.patch_shape[0]}x{self.patch_shape[1]} patches, "
+                             f"got {size[0]}x{size[1]}; re-export it with this patch_size "
+                             f"or with dynamic height/width")
+        output = self.session.run(
+            None, {self.input_name: batch.cpu().numpy()})[0]
+        return torch.from_numpy(output)
+
+
+def load_backend(model_path, device='cpu', backend='eager', num_threads=None):
+    """Loads the segmentation model for one of the inference backends.
+
+    Args:
+        model_path (str): State dict (.pth) for 'eager', a frozen TorchScript
+            module (.pt) for 'torchscript' or an ONNX graph (.onnx) for 'onnx'.
+            The latter two are written by ``training/export.py``.
+        device (str): Torch device; ONNX Runtime always runs on CPU.
+        backend (str): One of BACKENDS.
+        num_threads (int, optional): Intra-op threads for ONNX Runtime.
+
+    Returns:
+        callable: Maps a (N, 3, H, W) tensor to (N, 1, H, W) probabilities.
+    """
+    if backend == 'eager':
+        return load_model(model_path, device)
+    if backend == 'torchscript':
+        return torch.jit.load(model_path, map_location=device).eval()
+    if backend == 'onnx':
+        return OnnxModel(model_path, num_threads=num_threads)
+
+    raise ValueError(f"Unknown backend: {backend}, expected one of {BACKENDS}")
@@ -0,0 +1,297 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from cache import StageCache, cached_output
+
+STAGES = ('download', 'predict', 'merge', 'borders', 'final_filter', 'visualize')
+
+DEFAULT_PARAMS = {
+    'download': {'buffer_m': 5_000, 'scale': 10, 'start_date': '2020-06-01', 'end_date': '2020-06-30'},
+    'predict': {'batch_size': 64, 'threads': 1},
+    'merge': {'proximity_meters': 3, 'min_area_sq_m': 30_000},
+    'borders': {'margin_pixels': 15},
+    'final_filter': {'proximity_meters': 300, 'min_area_sq_m': 80_000},
+    'visualize': {'mode': 'raster'},
+}
+
+DEFAULT_LIMITS = {'download': 4, 'predict': 2}
+
+OUTPUTS = {
+    'download': 'scene.tif',
+    'predict': 'output_crops.parquet',
+    'merge': 'crops_smart_merged.parquet',
+    'borders': 'crops_final_no_borders.parquet',
+    'final_filter': 'crops_final.geojson',
+    'visualize': 'overlay.png',
+}
+
+_limits = {}
+
+
+def load_manifest(path):
+    """Reads scenes from a JSON manifest.
+
+    Either a list or {"scenes": [...]}. Each scene has a unique "name" and
+    either "image" (an existing GeoTIFF) or "lon"/"lat" (plus optional
+    download parameters) for an Earth Engine export.
+    """
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    scenes = manifest['scenes'] if isinstance(manifest, dict) else manifest
+
+    names = set()
+    for scene in scenes:
+        if 'name' not in scene:
+            raise ValueError(f"Scene without a name: {scene}")
+        if scene['name'] in names:
+            raise ValueError(f"Duplicate scene name: {scene['name']}")
+        if 'image' not in scene and not ('lon' in scene and 'lat' in scene):
+            raise ValueError(f"Scene {scene['name']} needs 'image' or 'lon'/'lat'")
+        names.add(scene['name'])
+
+    return scenes
+
+
+class Checkpoint:
+    """Per-scene record of completed stages, their parameters and timings."""
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.stages = json.load(f).get('stages', {})
+
+    def is_done(self, stage, params, output):
+        record = self.stages.get(stage)
+        return (record is not None and record['params'] == params
+                and os.path.exists(output))
+
+    def mark_done(self, stage, params, seconds):
+        self.stages[stage] = {'params': params, 'seconds': round(seconds, 3)}
+        self.save()
+
+    def invalidate_from(self, stage):
+        for later in STAGES[STAGES.index(stage):]:
+            self.stages.pop(later, None)
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'stages': self.stages}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _init_worker(limits):
+    _limits.update(limits)
+
+
+STAGE_INPUTS = {
+    'predict': ('download',),
+    'merge': ('predict',),
+    'borders': ('merge', 'download'),
+    'final_filter': ('borders',),
+    'visualize': ('download', 'final_filter'),
+}
+
+
+def run_stage(name, scene, paths, params, model_path, cache=None):
+    if name == 'download':
+        if 'image' not in scene:
+            from download import export_scene, init_earth_engine
+
+            init_earth_engine(scene.get('project', 'garden-481316'))
+            export_scene(scene['lon'], scene['lat'],
+                         paths['download'], **params)
+
+    elif name == 'predict':
+        import torch
+        from predict import predict_large_image
+
+        torch.set_num_threads(params['threads'])
+        predict_kwargs = {k: v for k, v in params.items() if k != 'threads'}
+        predict_large_image(model_path, paths['download'],
+                            paths['predict'], cache=cache, **predict_kwargs)
+
+    elif name == 'merge':
+        from filter_polygons import process_smart_merge
+
+        process_smart_merge(paths['predict'], paths['merge'], **params)
+
+    elif name == 'borders':
+        from remove_borders import remove_border_polygons
+
+        remove_border_polygons(paths['merge'], paths['download'],
+                               paths['borders'], **params)
+
+    elif name == 'final_filter':
+        from final_filter_polygons import process_smart_merge
+
+        process_smart_merge(paths['borders'], paths['final_filter'], **params)
+
+    elif name == 'visualize':
+        from visualize import visualize_overlay_filled
+
+        visualize_overlay_filled(paths['download'], paths['final_filter'],
+                                 paths['visualize'], **params)
+
+
+def run_cached_stage(name, scene, paths, params, model_path, cache):
+    """Restores the stage output from ``cache`` or runs the stage and stores it.
+
+    Keys cover the digests of the stage's input files, so a new merge
+    threshold misses for merge and everything after it, while predict
+    is still served from the cache.
+    """
+    if name == 'download' or cache is None:
+        run_stage(name, scene, paths, params, model_path)
+        return False
+
+    inputs = [paths[stage] for stage in STAGE_INPUTS[name]]
+    if name == 'predict':
+        inputs.append(model_path)
+
+    return cached_output(
+        cache, name, inputs, params, paths[name],
+        lambda: run_stage(name, scene, paths, params, model_path, cache))
+
+
+def run_scene(scene, output_dir, model_path, params, force=False, cache_dir=None,
+              cache_bytes=10 * 1024 ** 3):
+    """Runs every stage for one scene, resuming from its checkpoint.
+
+    A stage is skipped when the checkpoint has it with the same parameters
+    and its output file exists. A stage that reruns invalidates all later
+    stages. With ``cache_dir``, stage outputs and probability rasters are
+    shared through a ``StageCache`` across scenes' reruns and output dirs.
+
+    Returns:
+        dict: Scene name, final status and per-stage seconds.
+    """
+    scene_dir = os.path.join(output_dir, scene['name'])
+    os.makedirs(scene_dir, exist_ok=True)
+
+    paths = {stage: os.path.join(scene_dir, name)
+             for stage, name in OUTPUTS.items()}
+    if 'image' in scene:
+        paths['download'] = os.path.abspath(scene['image'])
+    checkpoint = Checkpoint(os.path.join(scene_dir, 'checkpoint.json'))
+    cache = StageCache(cache_dir, cache_bytes) if cache_dir else None
+
+    stage_params = {stage: {**params.get(stage, {}), **scene.get(stage, {})}
+                    for stage in STAGES}
+    if 'image' in scene:
+        stage_params['download'] = {'image': os.path.abspath(scene['image'])}
+
+    timings = {}
+    cache_hits = []
+    for stage in STAGES:
+        if not force and checkpoint.is_done(stage, stage_params[stage], paths[stage]):
+            timings[stage] = 'cached'
+            continue
+
+        checkpoint.invalidate_from(stage)
+
+        start = time.perf_counter()
+        with _limits.get(stage, nullcontext()):
+            if run_cached_stage(stage, scene, paths, stage_params[stage], model_path, cache):
+                cache_hits.append(stage)
+        seconds = time.perf_counter() - start
+
+        if not os.path.exists(paths[stage]):
+            status = 'empty' if stage != 'download' else 'failed'
+            return {'name': scene['name'], 'status': f"{status}:{stage}", 'timings': timings,
+                    'cache_hits': cache_hits}
+
+        checkpoint.mark_done(stage, stage_params[stage], seconds)
+        timings[stage] = round(seconds, 3)
+
+    return {'name': scene['name'], 'status': 'done', 'timings': timings, 'cache_hits': cache_hits}
+
+
+def run_batch(manifest_path, output_dir, model_path, workers=2, limits=None, params=None, force=False,
+              cache_dir=None, cache_bytes=10 * 1024 ** 3):
+    scenes = load_manifest(manifest_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    merged_params = {stage: {**DEFAULT_PARAMS[stage], **(params or {}).get(stage, {})}
+                     for stage in STAGES}
+    limits = {**DEFAULT_LIMITS, **(limits or {})}
+
+    results = []
+    with multiprocessing.Manager() as manager:
+        semaphores = {stage: manager.BoundedSemaphore(limit)
+                      for stage, limit in limits.items() if limit > 0}
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(semaphores,)) as pool:
+            futures = {pool.submit(run_scene, scene, output_dir, model_path, merged_params, force,
+                                   cache_dir, cache_bytes): scene
+                       for scene in scenes}
+
+            for future in as_completed(futures):
+                scene = futures[future]
+                try:
+                    result = future.result()
+                except Exception:
+                    result = {'name': scene['name'], 'status': 'error',
+                              'error': traceback.format_exc()}
+                results.append(result)
+                hits = f" кэш: {', '.join(result['cache_hits'])}" if result.get('cache_hits') else ''
+                print(f"[{result['name']}] {result['status']} {result.get('timings', '')}{hits}")
+
+    with open(os.path.join(output_dir, 'batch_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    return results
+
+
+def parse_limits(values):
+    limits = {}
+    for value in values:
+        stage, limit = value.split('=')
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}, expected one of {STAGES}")
+        limits[stage] = int(limit)
+    return limits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Пакетная обработка сцен: download → predict → merge → borders → final_filter → visualize")
+    parser.add_argument('manifest')
+    parser.add_argument('--output-dir', default='runs')
+    parser.add_argument('--model', default='best_model.pth')
+    parser.add_argument('--workers', type=int, default=2,
+                        help="Число сцен, обрабатываемых одновременно")
+    parser.add_argument('--limit', action='append', default=[],
+                        help="Ограничение одновременных этапов, например predict=2")
+    parser.add_argument('--params', default=None,
+                        help="JSON-файл с параметрами этапов")
+    parser.add_argument('--force', action='store_true',
+                        help="Игнорировать контрольные точки")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Каталог кэша результатов этапов")
+    parser.add_argument('--cache-size', type=float, default=10,
+                        help="Максимальный размер кэша, ГБ")
+    args = parser.parse_args()
+
+    params = None
+    if args.params:
+        with open(args.params, encoding='utf-8') as f:
+            params = json.load(f)
+
+    run_batch(args.manifest, args.output_dir, args.model,
+              workers=args.workers, limits=parse_limits(args.limit),
+              params=params, force=args.force,
+              cache_dir=args.cache_dir, cache_bytes=int(args.cache_size * 1024 ** 3))
@@ -0,0 +1,61 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+from backends import load_backend
+
+
+def benchmark_backend(model_path, backend, batch, repeats=20):
+    start = time.perf_counter()
+    model = load_backend(model_path, 'cpu', backend=backend)
+    load_time = time.perf_counter() - start
+
+    with torch.no_grad():
+        model(batch)
+
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            output = model(batch)
+            timings.append(time.perf_counter() - start)
+
+    return load_time, float(np.median(timings)), output[:, 0].numpy()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Сравнение eager / TorchScript / ONNX Runtime на CPU")
+    parser.add_argument('--eager', default='best_model.pth')
+    parser.add_argument('--torchscript', default='best_model.pt')
+    parser.add_argument('--onnx', default='best_model.onnx')
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 16, 64])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    paths = {'eager': args.eager,
+             'torchscript': args.torchscript, 'onnx': args.onnx}
+
+    for batch_size in args.batch_sizes:
+        torch.manual_seed(0)
+        batch = torch.rand(batch_size, 3, 64, 64)
+        reference = None
+
+        for backend, path in paths.items():
+            if not os.path.exists(path):
+                print(f"{backend:<12} | пропущен, нет файла {path}")
+                continue
+
+            load_time, latency, probability = benchmark_backend(
+                path, backend, batch, repeats=args.repeats)
+
+            if reference is None:
+                reference = probability
+            max_diff = float(np.abs(probability - reference).max())
+
+            print(f"{backend:<12} | batch={batch_size:>3} | загрузка {load_time:6.2f} с "
+                  f"| {latency * 1000:8.1f} мс/батч | {batch_size / latency:8.1f} патчей/с "
+                  f"| max |Δp| = {max_diff:.2e}")
@@ -0,0 +1,76 @@
+import argparse
+import os
+import tempfile
+import time
+
+import geopandas as gpd
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from benchmark_polygonize import make_dense_mask
+from polygonize import iter_mask_bands, iter_stitched_polygons
+from vector_io import read_layer, write_layer
+
+EXTENSIONS = ('.geojson', '.fgb', '.parquet')
+
+
+def make_polygon_layer(size, blur=1.0, seed=0):
+    mask = make_dense_mask(size, blur=blur, seed=seed)
+    transform = from_origin(500_000, 5_730_000, 10, 10)
+    polygons = np.concatenate(list(iter_stitched_polygons(
+        iter_mask_bands(mask), transform, size, size)))
+    return gpd.GeoDataFrame({'class': ['PermanentCrop'] * len(polygons)},
+                            geometry=polygons, crs=CRS.from_epsg(32637))
+
+
+def center_bbox(gdf, fraction=0.1):
+    minx, miny, maxx, maxy = gdf.total_bounds
+    half_w = (maxx - minx) * np.sqrt(fraction) / 2
+    half_h = (maxy - miny) * np.sqrt(fraction) / 2
+    cx, cy = (minx + maxx) / 2, (miny + maxy) / 2
+    return cx - half_w, cy - half_h, cx + half_w, cy + half_h
+
+
+def benchmark(gdf, tmp_dir, bbox_fraction=0.1):
+    bbox = center_bbox(gdf, bbox_fraction)
+    results = []
+
+    for ext in EXTENSIONS:
+        path = os.path.join(tmp_dir, 'layer' + ext)
+
+        start = time.perf_counter()
+        write_layer(gdf, path)
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        n_full = len(read_layer(path))
+        read_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        n_bbox = len(read_layer(path, bbox=bbox))
+        bbox_time = time.perf_counter() - start
+
+        results.append((ext, os.path.getsize(path), write_time, read_time, n_full, bbox_time, n_bbox))
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Сравнение GeoJSON, FlatGeobuf и GeoParquet: запись, чтение, чтение по bbox, размер")
+    parser.add_argument('--size', type=int, default=2000)
+    parser.add_argument('--blur', type=float, default=1.0)
+    parser.add_argument('--bbox-fraction', type=float, default=0.1,
+                        help="Доля площади слоя в окне bbox")
+    args = parser.parse_args()
+
+    gdf = make_polygon_layer(args.size, blur=args.blur)
+    print(f"Полигонов: {len(gdf)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = benchmark(gdf, tmp, args.bbox_fraction)
+
+    print(f"{'формат':<10}{'размер, МБ':>12}{'запись, с':>11}{'чтение, с':>11}{'bbox, с':>9}{'в bbox':>8}")
+    for ext, size, write_time, read_time, n_full, bbox_time, n_bbox in results:
+        print(f"{ext:<10}{size / 1e6:>12.2f}{write_time:>11.2f}{read_time:>11.2f}{bbox_time:>9.3f}{n_bbox:>8}")
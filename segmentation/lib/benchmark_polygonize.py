@@ -0,0 +1,63 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import geopandas as gpd
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.features import shapes
+from rasterio.transform import from_origin
+
+from polygonize import iter_mask_bands, polygonize_to_geojson
+
+
+def make_dense_mask(size, blur=1.0, fill=0.5, seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.random((size, size)).astype(np.float32)
+    if blur:
+        noise = cv2.GaussianBlur(noise, (0, 0), blur)
+    return (noise > np.quantile(noise, 1 - fill)).astype(np.uint8)
+
+
+def polygonize_features(binary_mask, transform, crs, output_path):
+    results = (
+        {'properties': {'class': 'PermanentCrop'}, 'geometry': s}
+        for i, (s, v)
+        in enumerate(shapes(binary_mask, mask=binary_mask, transform=transform))
+    )
+    gdf = gpd.GeoDataFrame.from_features(list(results))
+    gdf.crs = crs
+    gdf.to_file(output_path, driver='GeoJSON')
+    return len(gdf)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Сравнение полигонизации через from_features и потоковой по полосам")
+    parser.add_argument('--size', type=int, default=2000)
+    parser.add_argument('--blur', type=float, default=1.0)
+    parser.add_argument('--band-height', type=int, default=512)
+    args = parser.parse_args()
+
+    mask = make_dense_mask(args.size, blur=args.blur)
+    transform = from_origin(500_000, 5_730_000, 10, 10)
+    crs = CRS.from_epsg(32637)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        n_old = polygonize_features(
+            mask, transform, crs, os.path.join(tmp, 'old.geojson'))
+        old_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        n_new = polygonize_to_geojson(
+            iter_mask_bands(mask, args.band_height), transform, crs,
+            args.size, args.size, os.path.join(tmp, 'new.geojson'))
+        new_time = time.perf_counter() - start
+
+    print(f"from_features: {n_old} полигонов за {old_time:.2f} с "
+          f"({n_old / old_time:.0f} полигонов/с)")
+    print(f"по полосам:    {n_new} полигонов за {new_time:.2f} с "
+          f"({n_new / new_time:.0f} полигонов/с)")
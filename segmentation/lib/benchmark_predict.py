@@ -0,0 +1,107 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+import segmentation_models_pytorch as smp
+import torch
+from rasterio.transform import from_origin
+
+from backends import load_model
+from predict import build_preprocess, iter_windows, predict_probability, predict_probability_parallel
+
+
+def make_synthetic_scene(path, size=700, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, 255, size=(3, size, size), dtype=np.uint8)
+
+    profile = {
+        'driver': 'GTiff',
+        'height': size,
+        'width': size,
+        'count': 3,
+        'dtype': 'uint8',
+        'crs': 'EPSG:32637',
+        'transform': from_origin(500_000, 5_730_000, 10, 10),
+    }
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data)
+    return path
+
+
+def benchmark(model, image_path, device, batch_sizes, patch_size=64, stride=35):
+    preprocess = build_preprocess()
+
+    with rasterio.open(image_path) as src:
+        n_patches = sum(1 for _ in iter_windows(
+            src.height, src.width, patch_size, stride))
+
+        reference = None
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            probability = predict_probability(
+                model, preprocess, src, device,
+                patch_size=patch_size, stride=stride, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+
+            if reference is None:
+                reference = probability
+            max_diff = float(np.abs(probability - reference).max())
+
+            print(f"batch_size={batch_size:>4} | {n_patches / elapsed:9.1f} патчей/с "
+                  f"| {elapsed:7.2f} с | max |Δp| = {max_diff:.2e}")
+
+
+def benchmark_workers(model_path, image_path, workers_list, batch_size, patch_size=64, stride=35):
+    with rasterio.open(image_path) as src:
+        n_patches = sum(1 for _ in iter_windows(
+            src.height, src.width, patch_size, stride))
+
+    reference = None
+    for workers in workers_list:
+        start = time.perf_counter()
+        probability = predict_probability_parallel(
+            model_path, image_path, patch_size=patch_size, stride=stride,
+            batch_size=batch_size, workers=workers)
+        elapsed = time.perf_counter() - start
+
+        if reference is None:
+            reference = probability
+        max_diff = float(np.abs(probability - reference).max())
+
+        print(f"workers={workers:>3} | {n_patches / elapsed:9.1f} патчей/с "
+              f"| {elapsed:7.2f} с | max |Δp| = {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Сравнение попатчевого и батчевого инференса predict_large_image")
+    parser.add_argument('--model', default='best_model.pth')
+    parser.add_argument('--image', default=None)
+    parser.add_argument('--size', type=int, default=700)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 16, 64, 256])
+    parser.add_argument('--workers', type=int, nargs='*', default=[],
+                        help="Дополнительно замерить многопроцессный режим")
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if not os.path.exists(model_path):
+            print(f"Веса {args.model} не найдены, используется случайная инициализация.")
+            model_path = os.path.join(tmp, 'random.pth')
+            torch.save(smp.Unet(encoder_name="resnet34", encoder_weights=None,
+                                classes=1, activation='sigmoid').state_dict(), model_path)
+        model = load_model(model_path, device)
+
+        image_path = args.image or make_synthetic_scene(
+            os.path.join(tmp, 'scene.tif'), size=args.size)
+        benchmark(model, image_path, device, args.batch_sizes)
+
+        if args.workers:
+            benchmark_workers(model_path, image_path,
+                              args.workers, max(args.batch_sizes))
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+WINDOWS = ('uniform', 'gaussian', 'cosine')
+
+
+def window_profile(patch_size, window='uniform', sigma_scale=0.25):
+    """1-D weighting profile across a patch; the 2-D window is its outer product.
+
+    Args:
+        patch_size (int): Patch side in pixels.
+        window (str): 'uniform', 'gaussian' or 'cosine'.
+        sigma_scale (float): Gaussian sigma as a fraction of patch_size.
+
+    Returns:
+        np.ndarray: Strictly positive float64 weights of length patch_size.
+    """
+    centers = np.arange(patch_size) + 0.5
+
+    if window == 'uniform':
+        return np.ones(patch_size)
+    if window == 'gaussian':
+        sigma = sigma_scale * patch_size
+        return np.exp(-0.5 * ((centers - patch_size / 2) / sigma) ** 2)
+    if window == 'cosine':
+        return np.sin(np.pi * centers / patch_size)
+
+    raise ValueError(f"Unknown blending window: {window}, expected one of {WINDOWS}")
+
+
+def axis_normalization(length, patch_size, stride, profile):
+    total = np.zeros(length)
+    for start in range(0, length, stride):
+        end = min(start + patch_size, length)
+        total[start:end] += profile[:end - start]
+
+    norm = np.zeros(length)
+    np.divide(1.0, total, out=norm, where=total > 0)
+    return norm
+
+
+class BlendWeights:
+    """Precomputed, normalized blending weights for a sliding-window scan.
+
+    Windows start every ``stride`` pixels and are clipped at the scene edge,
+    so the sum of separable window weights over all windows covering a
+    pixel factorizes into a row term and a column term. Both are inverted
+    once here. Weighting each patch with ``patch(...)`` and summing directly
+    gives the blended probability. No count array or division pass is
+    needed, and the extra memory is O(h + w).
+
+    Args:
+        h (int): Scene height.
+        w (int): Scene width.
+        patch_size (int): Patch side in pixels.
+        stride (int): Step between windows.
+        window (str): 'uniform' reproduces plain averaging; 'gaussian' and
+            'cosine' down-weight patch borders to suppress seams.
+    """
+
+    def __init__(self, h, w, patch_size, stride, window='uniform'):
+        self.profile = window_profile(patch_size, window)
+        self.norm_y = axis_normalization(h, patch_size, stride, self.profile)
+        self.norm_x = axis_normalization(w, patch_size, stride, self.profile)
+
+    def patch(self, x, y, win_w, win_h):
+        wy = self.profile[:win_h] * self.norm_y[y:y + win_h]
+        wx = self.profile[:win_w] * self.norm_x[x:x + win_w]
+        return np.outer(wy, wx).astype(np.float32)
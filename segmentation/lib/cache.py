@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+DIGEST_CHUNK = 1 << 20
+
+
+class StageCache:
+    """Content-addressed store for stage artifacts with size-bounded LRU eviction.
+
+    Keys hash the stage name, the SHA-256 of every input file and the
+    stage parameters, so a changed raster, new weights or a new threshold
+    gives a new key. File digests are remembered by (path, size, mtime),
+    so an unchanged multi-gigabyte scene is hashed once. Reads refresh an
+    entry's mtime; ``put`` removes the least recently used entries until
+    the cache fits in ``max_bytes``.
+    """
+
+    def __init__(self, root='.cache', max_bytes=10 * 1024 ** 3):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._digests_path = os.path.join(self.root, 'digests.json')
+        self._digests = None
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if self._digests is None:
+            self._digests = self._load_digests()
+
+        record = self._digests.get(path)
+        if record and record['size'] == stat.st_size and record['mtime_ns'] == stat.st_mtime_ns:
+            return record['sha256']
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DIGEST_CHUNK), b''):
+                sha.update(chunk)
+
+        self._digests[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                               'sha256': sha.hexdigest()}
+        self._save_digests()
+        return sha.hexdigest()
+
+    def key(self, stage, files=(), params=None):
+        payload = {
+            'stage': stage,
+            'files': [self.file_digest(path) for path in files],
+            'params': params or {},
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def path(self, key, suffix=''):
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def get(self, key, suffix, dest):
+        """Checks out a cached entry to ``dest`` and returns ``dest``, or None on a miss.
+
+        Another process's ``put`` may evict the entry at any time, so callers
+        never read the entry path itself. ``dest`` is a hard link when it is
+        a ``tmp_path`` of this cache: it survives eviction, is never written
+        to, and the caller removes it. Any other ``dest`` gets a copy, since
+        a stage may later rewrite that file in place. An entry evicted
+        before it is checked out counts as a miss.
+        """
+        path = self.path(key, suffix)
+        linked = os.path.dirname(os.path.abspath(dest)) == self.root
+        tmp_path = dest + '.link' if linked else self.tmp_path(suffix)
+        try:
+            os.utime(path)
+            if linked:
+                os.link(path, tmp_path)
+            else:
+                shutil.copyfile(path, tmp_path)
+        except FileNotFoundError:
+            if not linked:
+                os.remove(tmp_path)
+            self.misses += 1
+            return None
+
+        os.replace(tmp_path, dest)
+        self.hits += 1
+        return dest
+
+    def tmp_path(self, suffix=''):
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.root, prefix='.tmp-')
+        os.close(fd)
+        return path
+
+    def put(self, key, suffix, source_path, move=False):
+        """Stores ``source_path`` under ``key`` and evicts old entries."""
+        path = self.path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if move:
+            os.replace(source_path, path)
+        else:
+            tmp_path = self.tmp_path(suffix)
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return total
+
+    def _load_digests(self):
+        try:
+            with open(self._digests_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_digests(self):
+        tmp_path = self.tmp_path('.json')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._digests, f)
+        os.replace(tmp_path, self._digests_path)
+
+
+def cached_output(cache, stage, inputs, params, output_path, run):
+    """Runs ``run()`` to produce ``output_path`` unless the cache has it.
+
+    Returns:
+        bool: True when the output was restored from the cache.
+    """
+    if cache is None:
+        run()
+        return False
+
+    key = cache.key(stage, inputs, params)
+    suffix = os.path.splitext(output_path)[1]
+    if cache.get(key, suffix, output_path) is not None:
+        return True
+
+    run()
+    if os.path.exists(output_path):
+        cache.put(key, suffix, output_path)
+    return False
@@ -0,0 +1,256 @@
+import argparse
+import contextlib
+import json
+import os
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+from indices import SPECTRAL_BANDS, band_indexes
+
+METHODS = ('median', 'percentile', 'max_ndvi')
+
+# QA60 bits 10 and 11 are opaque clouds and cirrus, as in download.mask_s2_clouds.
+CLOUD_BITS = (1 << 10) | (1 << 11)
+
+
+def state_path(composite_path):
+    """Sidecar raster with what an incremental update needs besides the composite."""
+    return os.path.splitext(composite_path)[0] + '_state.tif'
+
+
+def open_aligned(stack, path, grid):
+    """Opens ``path``, warped to ``grid`` = (crs, transform, width, height) if it is not on it."""
+    src = stack.enter_context(rasterio.open(path))
+    crs, transform, width, height = grid
+    if (src.crs, src.transform, src.width, src.height) != grid:
+        src = stack.enter_context(WarpedVRT(src, crs=crs, transform=transform, width=width,
+                                            height=height, resampling=Resampling.nearest))
+    return src
+
+
+def scene_sources(stack, path, qa_path, bands, grid):
+    """(src, band indexes, qa src, qa band) of one date; the QA60 band may be in the scene itself."""
+    src = open_aligned(stack, path, grid)
+    indexes = band_indexes(src, bands)
+    if qa_path:
+        return src, indexes, open_aligned(stack, qa_path, grid), 1
+    if 'QA60' in src.descriptions:
+        return src, indexes, src, src.descriptions.index('QA60') + 1
+    return src, indexes, None, None
+
+
+def read_clear(scene, window):
+    """Bands of one date in ``window`` as float32, NaN for nodata and QA60 clouds."""
+    src, indexes, qa_src, qa_band = scene
+    data = src.read(indexes, window=window, masked=True).astype(np.float32).filled(np.nan)
+    if qa_src is not None:
+        data[:, (qa_src.read(qa_band, window=window) & CLOUD_BITS) != 0] = np.nan
+    return data
+
+
+def ndvi(data, bands):
+    b4, b8 = data[..., bands.index('B4'), :, :], data[..., bands.index('B8'), :, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (b8 - b4) / (b8 + b4)
+
+
+def sorted_percentile(values, q):
+    """Percentile along axis 0 of values sorted with NaN last, interpolated like np.nanpercentile."""
+    count = np.isfinite(values).sum(axis=0)
+    rank = q / 100 * np.maximum(count - 1, 0)
+    lower = np.floor(rank).astype(np.int64)
+    upper = np.ceil(rank).astype(np.int64)
+    low = np.take_along_axis(values, lower[None], axis=0)[0]
+    high = np.take_along_axis(values, upper[None], axis=0)[0]
+    return low + (rank - lower) * (high - low)
+
+
+def max_ndvi_pick(stack, bands):
+    """Per pixel, the date with the highest NDVI: (composite, its NDVI, date index)."""
+    values = ndvi(stack, bands)
+    best = np.argmax(np.where(np.isfinite(values), values, -np.inf), axis=0)
+    best_ndvi = np.take_along_axis(values, best[None], axis=0)[0]
+    composite = np.take_along_axis(stack, best[None, None], axis=0)[0]
+    clear = np.isfinite(best_ndvi)
+    composite[:, ~clear] = np.nan
+    return composite, best_ndvi, np.where(clear, best, np.nan).astype(np.float32)
+
+
+def to_output(data, profile):
+    """Casts float32 data with NaN to the composite dtype and nodata."""
+    if np.issubdtype(np.dtype(profile['dtype']), np.integer):
+        info = np.iinfo(profile['dtype'])
+        data = np.where(np.isnan(data), profile['nodata'], np.clip(np.rint(data), info.min, info.max))
+    return data.astype(profile['dtype'])
+
+
+def output_profiles(src, bands, method, n_dates):
+    """Profiles of the composite (source dtype) and of its float32 state raster."""
+    dtype = src.dtypes[0]
+    nodata = src.nodata
+    if nodata is None:
+        nodata = 0 if np.issubdtype(np.dtype(dtype), np.integer) else np.nan
+
+    base = dict(driver='GTiff', width=src.width, height=src.height, crs=src.crs, transform=src.transform,
+                tiled=True, blockxsize=256, blockysize=256, compress='deflate')
+    composite = dict(base, count=len(bands), dtype=dtype, nodata=nodata)
+    # max_ndvi keeps the winning NDVI and date index; median/percentile keep
+    # every clear value per pixel, sorted with NaN last.
+    state_count = 2 if method == 'max_ndvi' else n_dates * len(bands)
+    state = dict(base, count=state_count, dtype='float32', nodata=np.nan, predictor=3)
+    return composite, state
+
+
+def composite(scene_paths, output_path, method='median', q=50, qa_paths=None, dates=None,
+              bands=SPECTRAL_BANDS, block_rows=256):
+    """Builds a cloud-free composite of per-date scenes, window by window.
+
+    Clouds come from QA60, either ``qa_paths`` (one single-band raster per
+    scene) or a band named QA60 in the scene. Scenes are aligned to the
+    grid of the first one. Only one strip of every date is in memory at a
+    time: dates * bands * block_rows * width float32 values.
+
+    Args:
+        method (str): 'median', 'percentile' (``q``) or 'max_ndvi' (bands of
+            the clearest-greenest date per pixel).
+        dates (list[str]): Labels of the scenes, by default their file names.
+
+    Returns:
+        str: ``output_path``; ``state_path(output_path)`` is written next to it
+        for ``update_composite``.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method}, expected one of {METHODS}")
+    bands = list(bands)
+    qa_paths = qa_paths or [None] * len(scene_paths)
+    dates = list(dates or [os.path.splitext(os.path.basename(path))[0] for path in scene_paths])
+    q = 50 if method == 'median' else q
+
+    with contextlib.ExitStack() as stack:
+        first = stack.enter_context(rasterio.open(scene_paths[0]))
+        grid = (first.crs, first.transform, first.width, first.height)
+        scenes = [scene_sources(stack, path, qa_path, bands, grid)
+                  for path, qa_path in zip(scene_paths, qa_paths)]
+        profile, state_profile = output_profiles(first, bands, method, len(scenes))
+
+        dst = stack.enter_context(rasterio.open(output_path, 'w', **profile))
+        state = stack.enter_context(rasterio.open(state_path(output_path), 'w', **state_profile))
+        dst.descriptions = tuple(bands)
+        dst.update_tags(METHOD=method, Q=q, DATES=json.dumps(dates))
+
+        for y in range(0, first.height, block_rows):
+            window = Window(0, y, first.width, min(block_rows, first.height - y))
+            data = np.stack([read_clear(scene, window) for scene in scenes])
+
+            if method == 'max_ndvi':
+                result, best_ndvi, best_date = max_ndvi_pick(data, bands)
+                state.write(np.stack([best_ndvi, best_date]), window=window)
+            else:
+                data.sort(axis=0)
+                result = sorted_percentile(data, q)
+                state.write(data.reshape(-1, window.height, window.width), window=window)
+
+            dst.write(to_output(result, profile), window=window)
+
+    return output_path
+
+
+def update_composite(composite_path, scene_path, qa_path=None, date=None, block_rows=256):
+    """Adds one date to an existing composite without reading the earlier scenes.
+
+    max_ndvi is updated in place: only pixels where the new date is greener
+    are rewritten. median and percentile insert the new clear values into
+    the sorted per-pixel state and recompute the percentile from it.
+    """
+    date = date or os.path.splitext(os.path.basename(scene_path))[0]
+
+    with rasterio.open(composite_path) as src:
+        tags = src.tags()
+        bands = list(src.descriptions)
+        grid = (src.crs, src.transform, src.width, src.height)
+        method, q, dates = tags['METHOD'], float(tags['Q']), json.loads(tags['DATES'])
+
+    if date in dates:
+        print(f"Дата {date} уже в композите {composite_path}")
+        return composite_path
+
+    if method == 'max_ndvi':
+        with contextlib.ExitStack() as stack:
+            scene = scene_sources(stack, scene_path, qa_path, bands, grid)
+            dst = stack.enter_context(rasterio.open(composite_path, 'r+'))
+            state = stack.enter_context(rasterio.open(state_path(composite_path), 'r+'))
+
+            for y in range(0, dst.height, block_rows):
+                window = Window(0, y, dst.width, min(block_rows, dst.height - y))
+                data = read_clear(scene, window)
+                new_ndvi = ndvi(data, bands)
+                best_ndvi, best_date = state.read(window=window)
+
+                greener = np.isfinite(new_ndvi) & ~(new_ndvi <= best_ndvi)
+                if not greener.any():
+                    continue
+
+                result = dst.read(window=window)
+                result[:, greener] = to_output(data[:, greener], dst.profile)
+                best_ndvi[greener] = new_ndvi[greener]
+                best_date[greener] = len(dates)
+                dst.write(result, window=window)
+                state.write(np.stack([best_ndvi, best_date]), window=window)
+
+            dst.update_tags(DATES=json.dumps(dates + [date]))
+        return composite_path
+
+    # The state grows by one slot per date, so it is rewritten next to the old one.
+    new_state_path = state_path(composite_path) + '.tmp'
+    with contextlib.ExitStack() as stack:
+        scene = scene_sources(stack, scene_path, qa_path, bands, grid)
+        dst = stack.enter_context(rasterio.open(composite_path, 'r+'))
+        state = stack.enter_context(rasterio.open(state_path(composite_path)))
+        new_state = stack.enter_context(rasterio.open(
+            new_state_path, 'w', **dict(state.profile, count=state.count + len(bands))))
+        profile = dst.profile
+
+        for y in range(0, dst.height, block_rows):
+            window = Window(0, y, dst.width, min(block_rows, dst.height - y))
+            data = np.concatenate([
+                state.read(window=window).reshape(-1, len(bands), window.height, window.width),
+                read_clear(scene, window)[None]])
+            data.sort(axis=0)
+            dst.write(to_output(sorted_percentile(data, q), profile), window=window)
+            new_state.write(data.reshape(-1, window.height, window.width), window=window)
+
+        dst.update_tags(DATES=json.dumps(dates + [date]))
+
+    os.replace(new_state_path, state_path(composite_path))
+    return composite_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Композит по датам без облаков (QA60): медиана, процентиль или максимум NDVI")
+    parser.add_argument('output')
+    parser.add_argument('scenes', nargs='+', help="Снимки по датам с каналами B2, B3, B4, B8, B11")
+    parser.add_argument('--method', choices=METHODS, default='median')
+    parser.add_argument('--q', type=float, default=50, help="Процентиль для --method percentile")
+    parser.add_argument('--qa', nargs='+', default=None,
+                        help="Маски QA60 по одной на снимок; по умолчанию канал QA60 снимка")
+    parser.add_argument('--update', action='store_true',
+                        help="Добавить снимки в существующий композит")
+    args = parser.parse_args()
+
+    qa_paths = args.qa or [None] * len(args.scenes)
+
+    if args.update:
+        for scene_path, qa_path in zip(args.scenes, qa_paths):
+            update_composite(args.output, scene_path, qa_path)
+            print(f"Добавлен снимок: {scene_path}")
+    else:
+        composite(args.scenes, args.output, args.method, args.q, qa_paths)
+
+    with rasterio.open(args.output) as src:
+        print(f"Композит {src.tags()['METHOD']}, дат: {len(json.loads(src.tags()['DATES']))}")
+    print(f"Сохранено: {args.output}")
@@ -2,7 +2,13 @@ from PIL import Image
 import ee
 import geemap.core as geemap
 from geemap import ee_export_image
+import numpy as np
 import os
+import rasterio
+import rasterio.shutil
+from rasterio.windows import Window
+
+from indices import SPECTRAL_BANDS
 
 
 def mask_s2_clouds(image):
@@ -30,55 +36,190 @@ def mask_s2_clouds(image):
     return image.updateMask(mask).divide(10000)
 
 
-ee.Authenticate()
-ee.Initialize(project='garden-481316')
-
-dataset = (
-    ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-    .filterDate('2020-06-01', '2020-06-30')
-    # Pre-filter to get less cloudy granules.
-    .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))
-    .map(mask_s2_clouds)
-)
-
-visualization = {
+VISUALIZATION = {
     'min': 0.0,
     'max': 0.3,
     'bands': ['B4', 'B3', 'B2'],
 }
 
-m = geemap.Map()
-m.set_center(39.476002, 51.715833, 12)
-m.add_layer(dataset.mean(), visualization, 'RGB')
 
-center_point = ee.Geometry.Point([39.476002, 51.715833,])
-region = center_point.buffer(5_000).bounds()
+def init_earth_engine(project='garden-481316'):
+    ee.Authenticate()
+    ee.Initialize(project=project)
 
 
-image = dataset.mean()
-rgb_image = image.visualize(**visualization)
+def build_collection(start_date='2020-06-01', end_date='2020-06-30', max_cloud_percentage=20):
+    return (
+        ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+        .filterDate(start_date, end_date)
+        # Pre-filter to get less cloudy granules.
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', max_cloud_percentage))
+        .map(mask_s2_clouds)
+    )
 
-output_file = "sentinel_rgb_10m_5000_voronezh.tif"
 
-try:
-    ee_export_image(
-        rgb_image,
-        filename=output_file,
-        scale=10,
-        region=region,
-        file_per_band=False,
-    )
+def export_scene(lon, lat, output_file, buffer_m=5_000, scale=10,
+                 start_date='2020-06-01', end_date='2020-06-30'):
+    """Exports the visualized RGB composite around a point to a GeoTIFF.
+
+    Returns:
+        str: Path of the written file, or None if the export failed.
+    """
+    region = ee.Geometry.Point([lon, lat]).buffer(buffer_m).bounds()
+
+    image = build_collection(start_date, end_date).mean()
+    rgb_image = image.visualize(**VISUALIZATION)
+
+    try:
+        ee_export_image(
+            rgb_image,
+            filename=output_file,
+            scale=scale,
+            region=region,
+            file_per_band=False,
+        )
+    except Exception as e:
+        print("Ошибка при скачивании:", e)
+        return None
+
+    if not os.path.exists(output_file):
+        print("Ошибка при скачивании:", output_file)
+        return None
+
     print(f"Успешно сохранено: {os.path.abspath(output_file)}")
-except Exception as e:
-    print("Ошибка при скачивании:", e)
+    return output_file
 
 
-def tif_to_jpg(tif_path, jpg_path=None, quality=95):
-    Image.MAX_IMAGE_PIXELS = None
+def export_bands(lon, lat, output_file, bands=SPECTRAL_BANDS, buffer_m=5_000, scale=10,
+                 start_date='2020-06-01', end_date='2020-06-30'):
+    """Exports the raw cloud-masked reflectance bands around a point as float32.
+
+    Band order follows ``bands``; 20 m bands such as B11 are resampled to
+    ``scale``. This is the input of ``indices.py``.
+    """
+    region = ee.Geometry.Point([lon, lat]).buffer(buffer_m).bounds()
+    image = build_collection(start_date, end_date).mean().select(list(bands)).toFloat()
+
+    try:
+        ee_export_image(
+            image,
+            filename=output_file,
+            scale=scale,
+            region=region,
+            file_per_band=False,
+        )
+    except Exception as e:
+        print("Ошибка при скачивании:", e)
+        return None
+
+    if not os.path.exists(output_file):
+        print("Ошибка при скачивании:", output_file)
+        return None
+
+    print(f"Успешно сохранено: {os.path.abspath(output_file)}")
+    return output_file
 
+
+class EarthEngineClient:
+    """Exports tiles of the visualized RGB composite for ``tiled_download``.
+
+    With ``bands`` it exports those raw reflectance bands as float32
+    instead. Any object with the same ``export_tile`` method can be passed
+    to ``export_aoi``, e.g. a local fake that writes synthetic tiles.
+    """
+
+    def __init__(self, project='garden-481316', start_date='2020-06-01', end_date='2020-06-30',
+                 max_cloud_percentage=20, authenticate=True, bands=None):
+        if authenticate:
+            init_earth_engine(project)
+        image = build_collection(start_date, end_date, max_cloud_percentage).mean()
+        if bands:
+            self.image = image.select(list(bands)).toFloat()
+        else:
+            self.image = image.visualize(**VISUALIZATION)
+
+    def export_tile(self, bounds, crs, scale, output_file):
+        """Writes the part of the composite inside ``bounds`` (in ``crs``) to ``output_file``."""
+        region = ee.Geometry.Rectangle(list(bounds), proj=crs, geodesic=False)
+        ee_export_image(
+            self.image,
+            filename=output_file,
+            scale=scale,
+            crs=crs,
+            region=region,
+            file_per_band=False,
+            verbose=False,
+        )
+        if not os.path.exists(output_file):
+            raise RuntimeError(f"Earth Engine не вернул файл {output_file}")
+        return output_file
+
+
+def iter_rgb_rows(src, block_rows=None):
+    """Yields (window, uint8 RGB array) for full-width strips of ``src``.
+
+    A strip is one block row of the source, so only that much of the scene
+    is in memory. Single-band rasters are repeated into gray RGB and extra
+    bands such as alpha are dropped, as ``Image.convert('RGB')`` does.
+    """
+    block_rows = block_rows or src.block_shapes[0][0]
+    indexes = [1, 2, 3] if src.count >= 3 else [1, 1, 1]
+
+    for y in range(0, src.height, block_rows):
+        window = Window(0, y, src.width, min(block_rows, src.height - y))
+        data = src.read(indexes, window=window)
+        if data.dtype != np.uint8:
+            data = np.clip(data, 0, 255).astype(np.uint8)
+        yield window, data
+
+
+def write_rgb_tiff(tif_path, output_path, quality=95, compress='JPEG', block_rows=None):
+    """Converts a scene to a tiled, JPEG-compressed RGB GeoTIFF strip by strip."""
+    with rasterio.open(tif_path) as src:
+        profile = {
+            'driver': 'GTiff', 'width': src.width, 'height': src.height, 'count': 3,
+            'dtype': 'uint8', 'crs': src.crs, 'transform': src.transform,
+            'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+            'compress': compress, 'BIGTIFF': 'IF_SAFER',
+        }
+        if compress.upper() == 'JPEG':
+            profile.update(photometric='YCbCr', jpeg_quality=quality)
+
+        with rasterio.open(output_path, 'w', **profile) as dst:
+            for window, data in iter_rgb_rows(src, block_rows):
+                dst.write(data, window=window)
+
+    return output_path
+
+
+def tif_to_jpg(tif_path, jpg_path=None, quality=95, streaming=True):
+    """Converts a GeoTIFF to JPEG.
+
+    With ``streaming`` the scene is first copied strip by strip into a
+    temporary RGB GeoTIFF, and GDAL's JPEG driver then encodes it scanline
+    by scanline. Peak memory stays around one block row instead of the
+    full image that the PIL path decodes.
+    """
     if jpg_path is None:
         jpg_path = os.path.splitext(tif_path)[0] + ".jpg"
 
+    if streaming:
+        tmp_path = os.path.splitext(jpg_path)[0] + '.rgb.tmp.tif'
+        try:
+            write_rgb_tiff(tif_path, tmp_path, compress='DEFLATE')
+            with rasterio.Env(GDAL_PAM_ENABLED='NO'):
+                rasterio.shutil.copy(tmp_path, jpg_path, driver='JPEG', quality=quality)
+            print(f"Успешно сохранено: {jpg_path}")
+            return jpg_path
+        except Exception as e:
+            print(f"Ошибка при конвертации: {e}")
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    Image.MAX_IMAGE_PIXELS = None
+
     try:
         with Image.open(tif_path) as img:
             print(
@@ -93,3 +234,13 @@ def tif_to_jpg(tif_path, jpg_path=None, quality=95):
     except Exception as e:
         print(f"Ошибка при конвертации: {e}")
         return None
+
+
+if __name__ == "__main__":
+    init_earth_engine()
+
+    m = geemap.Map()
+    m.set_center(39.476002, 51.715833, 12)
+    m.add_layer(build_collection().mean(), VISUALIZATION, 'RGB')
+
+    export_scene(39.476002, 51.715833, "sentinel_rgb_10m_5000_voronezh.tif")
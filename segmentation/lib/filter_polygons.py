@@ -1,34 +1,83 @@
 import geopandas as gpd
+import numpy as np
+import shapely
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
-warnings.filterwarnings("ignore")
-
+from vector_io import read_layer, write_layer
 
-def process_smart_merge(input_geojson, output_geojson, proximity_meters=15, min_area_sq_m=500):
-    try:
-        gdf = gpd.read_file(input_geojson)
-    except Exception as e:
-        print(f"Ошибка: {e}")
-        return
-
-    if gdf.empty:
-        return
+warnings.filterwarnings("ignore")
 
-    original_crs = gdf.crs
 
+def to_utm(gdf):
     if gdf.crs.is_geographic:
         utm_crs = gdf.estimate_utm_crs()
         print(f"   Перевод в UTM зону: {utm_crs.name}")
-        gdf = gdf.to_crs(utm_crs)
-    else:
-        utm_crs = gdf.crs
+        return gdf.to_crs(utm_crs)
+    return gdf
+
+
+def cluster_labels(geometries):
+    """Connected components of the "intersects" graph, via an STRtree."""
+    left, right = shapely.STRtree(geometries).query(
+        geometries, predicate='intersects')
+
+    labels = np.arange(len(geometries))
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, left, labels[right])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def merge_cluster(geometries, proximity_meters):
+    merged = shapely.union_all(geometries)
+    return merged.buffer(-proximity_meters, join_style=2)
+
+
+def partitioned_merge(buffered_geometries, proximity_meters, workers=1):
+    """Buffer-union-debuffer done per cluster of touching buffers.
+
+    Buffers from different clusters are disjoint. The union is therefore
+    the disjoint union of the cluster unions. The negative buffer of a
+    disjoint union is the union of the per-cluster negative buffers,
+    because a disc lies inside one connected piece. The result equals one
+    global union followed by a debuffer, but each union stays small and
+    the clusters can run in parallel.
+    """
+    geometries = np.asarray(buffered_geometries)
+    labels = cluster_labels(geometries)
+
+    order = np.argsort(labels, kind='stable')
+    splits = np.flatnonzero(np.diff(labels[order])) + 1
+    clusters = np.split(geometries[order], splits)
 
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(merge_cluster, clusters,
+                                 [proximity_meters] * len(clusters),
+                                 chunksize=max(1, len(clusters) // (workers * 4))))
+
+    return [merge_cluster(cluster, proximity_meters) for cluster in clusters]
+
+
+def smart_merge(gdf, proximity_meters=15, min_area_sq_m=500, partitioned=True, workers=1):
+    """Merges polygons closer than proximity_meters and drops small ones.
+
+    Works in the (metric) CRS of ``gdf`` and returns a layer in the same CRS.
+    ``partitioned=False`` runs the original single global union.
+    """
     buffered_geometries = gdf.buffer(proximity_meters, join_style=2)
-    merged_geom = buffered_geometries.unary_union
 
-    final_geom = merged_geom.buffer(-proximity_meters, join_style=2)
+    if partitioned:
+        final_geoms = partitioned_merge(
+            buffered_geometries.values, proximity_meters, workers)
+    else:
+        merged_geom = buffered_geometries.unary_union
+        final_geoms = [merged_geom.buffer(-proximity_meters, join_style=2)]
 
-    merged_gdf = gpd.GeoDataFrame(geometry=[final_geom], crs=utm_crs)
+    merged_gdf = gpd.GeoDataFrame(geometry=final_geoms, crs=gdf.crs)
     exploded_gdf = merged_gdf.explode(index_parts=False).reset_index(drop=True)
 
     exploded_gdf['area'] = exploded_gdf.geometry.area
@@ -38,15 +87,33 @@ def process_smart_merge(input_geojson, output_geojson, proximity_meters=15, min_
     final_gdf['geometry'] = final_gdf.geometry.simplify(
         tolerance=2, preserve_topology=True)
 
+    return final_gdf.drop(columns=['area'])
+
+
+def process_smart_merge(input_geojson, output_geojson, proximity_meters=15, min_area_sq_m=500, workers=1):
+    try:
+        gdf = read_layer(input_geojson)
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return
+
+    if gdf.empty:
+        return
+
+    original_crs = gdf.crs
+
+    gdf = to_utm(gdf)
+
+    final_gdf = smart_merge(gdf, proximity_meters,
+                            min_area_sq_m, workers=workers)
+
     print(f"   Было полигонов (исходно): {len(gdf)}")
     print(f"   Стало полигонов (итого): {len(final_gdf)}")
 
     if original_crs is not None:
         final_gdf = final_gdf.to_crs(original_crs)
 
-    final_gdf = final_gdf.drop(columns=['area'])
-
-    final_gdf.to_file(output_geojson, driver='GeoJSON')
+    write_layer(final_gdf, output_geojson)
     print(f" Сохранено: {output_geojson}")
 
 
@@ -0,0 +1,269 @@
+import argparse
+import datetime
+import json
+import os
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+import shapely
+from rasterio.windows import Window
+
+from zonal import DEFAULT_PERCENTILES, ZonalStats, iter_zone_windows, zone_raster
+
+SPECTRAL_BANDS = ('B2', 'B3', 'B4', 'B8', 'B11')
+INDICES = ('ndvi', 'evi', 'ndwi')
+
+# Same variable as backend/database.py; there is no default with credentials here.
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+
+def band_indexes(src, bands=SPECTRAL_BANDS):
+    """1-based indexes of ``bands`` in ``src``, by band description or by position."""
+    descriptions = list(src.descriptions)
+    if all(band in descriptions for band in bands):
+        return [descriptions.index(band) + 1 for band in bands]
+    if src.count < len(bands):
+        raise ValueError(f"{src.name}: need bands {bands}, found {src.count} unnamed bands")
+    return list(range(1, len(bands) + 1))
+
+
+def compute_indices(b2, b3, b4, b8, b11):
+    """NDVI, EVI and NDWI from surface reflectance arrays (0..1).
+
+    NDWI is Gao's (B8 - B11) / (B8 + B11), which tracks canopy water
+    content; B3 is accepted for the McFeeters variant but not used here.
+    Pixels with a zero denominator become NaN.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndvi = (b8 - b4) / (b8 + b4)
+        evi = 2.5 * (b8 - b4) / (b8 + 6 * b4 - 7.5 * b2 + 1)
+        ndwi = (b8 - b11) / (b8 + b11)
+    return {'ndvi': ndvi, 'evi': evi, 'ndwi': ndwi}
+
+
+def read_reflectance(src, window, indexes, scale_factor=None):
+    """Reads the bands in ``window`` as float32 reflectance with NaN for nodata."""
+    data = src.read(indexes, window=window, masked=True).astype(np.float32)
+    if scale_factor is None:
+        scale_factor = 1e-4 if np.issubdtype(np.dtype(src.dtypes[0]), np.integer) else 1.0
+    data *= scale_factor
+    return data.filled(np.nan)
+
+
+def iter_index_windows(src, indexes, block_rows=512, scale_factor=None):
+    """Yields (window, {index: float32 array}) for full-width row strips."""
+    for y in range(0, src.height, block_rows):
+        window = Window(0, y, src.width, min(block_rows, src.height - y))
+        b2, b3, b4, b8, b11 = read_reflectance(src, window, indexes, scale_factor)
+        yield window, compute_indices(b2, b3, b4, b8, b11)
+
+
+def write_indices(image_path, output_path, bands=SPECTRAL_BANDS, block_rows=512, scale_factor=None):
+    """Writes NDVI, EVI and NDWI as a three-band float32 GeoTIFF strip by strip."""
+    with rasterio.open(image_path) as src:
+        indexes = band_indexes(src, bands)
+        profile = src.profile.copy()
+        profile.update(driver='GTiff', count=len(INDICES), dtype='float32', nodata=np.nan,
+                       tiled=True, blockxsize=256, blockysize=256, compress='deflate', predictor=3)
+        profile.pop('photometric', None)
+
+        with rasterio.open(output_path, 'w', **profile) as dst:
+            dst.descriptions = INDICES
+            for window, values in iter_index_windows(src, indexes, block_rows, scale_factor):
+                dst.write(np.stack([values[name] for name in INDICES]), window=window)
+
+    return output_path
+
+
+def garden_index_means(image_path, gardens, labels_path=None, bands=SPECTRAL_BANDS, block_rows=512,
+                       scale_factor=None):
+    """Mean NDVI, EVI and NDWI per garden, for all gardens in one pass over the scene.
+
+    Gardens are rasterized once into a label raster on the scene grid
+    (``zonal.zone_raster``; kept at ``labels_path`` for the next date of the
+    same scene, otherwise temporary). Strips without gardens are not read.
+    NDVI also gets its median and 10th/90th percentiles.
+
+    Args:
+        gardens (gpd.GeoDataFrame): Garden polygons with an ``id`` column.
+
+    Returns:
+        pd.DataFrame: garden_id, ndvi, evi, ndwi, pixels, ndvi_median, ndvi_p10, ndvi_p90.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        labels_path = zone_raster(gardens, image_path, labels_path or os.path.join(tmp, 'zones.tif'),
+                                  block_rows)
+
+        with rasterio.open(image_path) as src, rasterio.open(labels_path) as labels_src:
+            indexes = band_indexes(src, bands)
+            stats = {name: ZonalStats(len(gardens), DEFAULT_PERCENTILES if name == 'ndvi' else ())
+                     for name in INDICES}
+
+            for window, label_arrays in iter_zone_windows(labels_src, block_rows):
+                b2, b3, b4, b8, b11 = read_reflectance(src, window, indexes, scale_factor)
+                values = compute_indices(b2, b3, b4, b8, b11)
+                for labels in label_arrays:
+                    for name in INDICES:
+                        stats[name].add(labels, values[name])
+
+    ndvi = stats['ndvi'].result(gardens['id'].to_numpy())
+    result = ndvi[['zone', 'mean']].rename(columns={'zone': 'garden_id', 'mean': 'ndvi'})
+    for name in INDICES[1:]:
+        result[name] = stats[name].result()['mean'].to_numpy()
+    result['pixels'] = ndvi['count']
+    for column in ndvi.columns[3:]:
+        result[f'ndvi_{column}'] = ndvi[column]
+    return result
+
+
+def vegetation_cycle_rows(stats, date):
+    """VegetationCycle column dicts for gardens with at least one valid pixel.
+
+    The reflected table does not know the Python-side defaults of
+    ``backend/models.py``, so they are filled in here.
+    """
+    created_at = datetime.datetime.now()
+    rows = []
+    for record in stats[stats['pixels'] > 0].itertuples(index=False):
+        rows.append({
+            'garden_id': int(record.garden_id),
+            'date': date,
+            'ndvi': float(record.ndvi),
+            'evi': float(record.evi),
+            'ndwi': float(record.ndwi),
+            'is_peak_vegetation': False,
+            'is_stress_period': False,
+            'created_at': created_at,
+        })
+    return rows
+
+
+def load_gardens(engine):
+    """Reads gardens from the database as a GeoDataFrame in EPSG:4326.
+
+    ``Garden.polygon`` holds a GeoJSON geometry or Feature.
+    """
+    from sqlalchemy import MetaData, Table, select
+
+    gardens = Table('gardens', MetaData(), autoload_with=engine)
+    with engine.connect() as conn:
+        records = conn.execute(select(gardens.c.id, gardens.c.polygon)).all()
+
+    ids, geometries = [], []
+    for garden_id, polygon in records:
+        if not polygon:
+            continue
+        if isinstance(polygon, str):
+            polygon = json.loads(polygon)
+        ids.append(garden_id)
+        geometries.append(shapely.geometry.shape(polygon.get('geometry', polygon)))
+
+    return gpd.GeoDataFrame({'id': ids}, geometry=geometries, crs='EPSG:4326')
+
+
+def insert_vegetation_cycles(engine, rows):
+    """Writes rows keyed on (garden_id, date) in one transaction.
+
+    Rows that already exist get their ndvi/evi/ndwi updated, so rerunning a
+    scene date does not duplicate them and keeps the weather columns; the
+    rest are inserted with one executemany.
+    """
+    if not rows:
+        return 0
+
+    from sqlalchemy import MetaData, Table, bindparam, select
+
+    cycles = Table('vegetation_cycles', MetaData(), autoload_with=engine)
+    keys = {(row['garden_id'], row['date']) for row in rows}
+
+    with engine.begin() as conn:
+        existing = set(conn.execute(
+            select(cycles.c.garden_id, cycles.c.date)
+            .where(cycles.c.date.in_({date for _, date in keys}))
+            .where(cycles.c.garden_id.in_({garden_id for garden_id, _ in keys}))).all())
+        updates = [row for row in rows if (row['garden_id'], row['date']) in existing]
+        inserts = [row for row in rows if (row['garden_id'], row['date']) not in existing]
+
+        if updates:
+            conn.execute(
+                cycles.update()
+                .where(cycles.c.garden_id == bindparam('key_garden'))
+                .where(cycles.c.date == bindparam('key_date'))
+                .values(ndvi=bindparam('ndvi'), evi=bindparam('evi'), ndwi=bindparam('ndwi')),
+                [{'key_garden': row['garden_id'], 'key_date': row['date'],
+                  'ndvi': row['ndvi'], 'evi': row['evi'], 'ndwi': row['ndwi']} for row in updates])
+        if inserts:
+            conn.execute(cycles.insert(), inserts)
+    return len(rows)
+
+
+def update_avg_ndvi(engine, stats):
+    """Sets Garden.avg_ndvi to the scene mean NDVI with one executemany UPDATE.
+
+    ``updated_at`` is set here, since the model's ``onupdate`` does not fire
+    on the reflected table.
+    """
+    from sqlalchemy import MetaData, Table, bindparam
+
+    rows = [{'garden': int(record.garden_id), 'value': float(record.ndvi)}
+            for record in stats[stats['pixels'] > 0].itertuples(index=False)]
+    if not rows:
+        return 0
+
+    gardens = Table('gardens', MetaData(), autoload_with=engine)
+    statement = (gardens.update()
+                 .where(gardens.c.id == bindparam('garden'))
+                 .values(avg_ndvi=bindparam('value'), updated_at=datetime.datetime.now()))
+    with engine.begin() as conn:
+        conn.execute(statement, rows)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="NDVI/EVI/NDWI по садам из снимка с каналами B2, B3, B4, B8, B11")
+    parser.add_argument('image')
+    parser.add_argument('--date', type=datetime.date.fromisoformat, required=True,
+                        help="Дата снимка, ГГГГ-ММ-ДД")
+    parser.add_argument('--gardens', default=None,
+                        help="Файл с полигонами садов (столбец id); по умолчанию таблица gardens")
+    parser.add_argument('--database-url', default=DATABASE_URL,
+                        help="По умолчанию переменная окружения DATABASE_URL")
+    parser.add_argument('--labels', default=None,
+                        help="Растр меток садов для повторного использования на других датах")
+    parser.add_argument('--indices-tif', default=None,
+                        help="Дополнительно сохранить растр индексов")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Не записывать в базу")
+    args = parser.parse_args()
+
+    engine = None
+    if not (args.gardens and args.dry_run):
+        if not args.database_url:
+            parser.error("нужен --database-url или переменная окружения DATABASE_URL")
+
+        from sqlalchemy import create_engine
+
+        engine = create_engine(args.database_url)
+
+    if args.gardens:
+        from vector_io import read_layer
+
+        gardens = read_layer(args.gardens)
+    else:
+        gardens = load_gardens(engine)
+    print(f"Садов: {len(gardens)}")
+
+    if args.indices_tif:
+        write_indices(args.image, args.indices_tif)
+        print(f"Растр индексов сохранён: {args.indices_tif}")
+
+    stats = garden_index_means(args.image, gardens, args.labels)
+    rows = vegetation_cycle_rows(stats, args.date)
+    print(stats.describe().loc[['mean', 'min', 'max']].round(3))
+
+    if not args.dry_run:
+        print(f"Записано строк VegetationCycle: {insert_vegetation_cycles(engine, rows)}")
+        print(f"Обновлено avg_ndvi садов: {update_avg_ndvi(engine, stats)}")
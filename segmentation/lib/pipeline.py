@@ -0,0 +1,105 @@
+import time
+import warnings
+
+import rasterio
+
+from filter_polygons import smart_merge, to_utm
+from predict import predict_polygons
+from remove_borders import remove_border
+from vector_io import write_layer
+
+warnings.filterwarnings("ignore")
+
+
+class Pipeline:
+    """Chain of GeoDataFrame -> GeoDataFrame stages with per-stage timings.
+
+    One layer in a metric CRS is passed from stage to stage in memory.
+    Nothing is written until the caller exports the result.
+    """
+
+    def __init__(self, stages=None):
+        self.stages = list(stages or [])
+        self.timings = {}
+
+    def add(self, name, stage):
+        self.stages.append((name, stage))
+        return self
+
+    def run(self, gdf=None):
+        self.timings = {}
+        for name, stage in self.stages:
+            start = time.perf_counter()
+            gdf = stage(gdf)
+            self.timings[name] = time.perf_counter() - start
+            print(f"   [{name}] {self.timings[name]:.2f} с, полигонов: {len(gdf)}")
+        return gdf
+
+
+def predict_stage(model_path, image_path, **predict_kwargs):
+    def stage(_):
+        gdf = predict_polygons(model_path, image_path, **predict_kwargs)
+        return gdf if gdf.empty else to_utm(gdf)
+    return stage
+
+
+def merge_stage(proximity_meters, min_area_sq_m):
+    def stage(gdf):
+        if gdf.empty:
+            return gdf
+        return smart_merge(gdf, proximity_meters, min_area_sq_m)
+    return stage
+
+
+def border_stage(tiff_path, margin_pixels):
+    with rasterio.open(tiff_path) as src:
+        img_bounds, img_crs, res = src.bounds, src.crs, src.res
+
+    def stage(gdf):
+        return remove_border(gdf, img_bounds, img_crs, res, margin_pixels)
+    return stage
+
+
+def export(gdf, output_path, crs=None):
+    if crs is not None and gdf.crs != crs:
+        gdf = gdf.to_crs(crs)
+    write_layer(gdf, output_path)
+    print(f" Сохранено: {output_path}")
+    return output_path
+
+
+def build_scene_pipeline(model_path, image_path, merge=(3, 30_000), margin_pixels=15, final_merge=(300, 80_000),
+                         **predict_kwargs):
+    """predict -> merge -> border removal -> final merge, as in the lib scripts' __main__ blocks."""
+    return Pipeline([
+        ('predict', predict_stage(model_path, image_path, **predict_kwargs)),
+        ('merge', merge_stage(*merge)),
+        ('borders', border_stage(image_path, margin_pixels)),
+        ('final_merge', merge_stage(*final_merge)),
+    ])
+
+
+def run_scene(model_path, image_path, output_path, **kwargs):
+    with rasterio.open(image_path) as src:
+        image_crs = src.crs
+
+    pipeline = build_scene_pipeline(model_path, image_path, **kwargs)
+    gdf = pipeline.run()
+
+    if gdf.empty:
+        print("Не найдено объектов класса PermanentCrop.")
+    else:
+        start = time.perf_counter()
+        export(gdf, output_path, crs=image_crs)
+        pipeline.timings['export'] = time.perf_counter() - start
+
+    total = sum(pipeline.timings.values())
+    print(f"   Итого: {total:.2f} с")
+    return gdf, pipeline.timings
+
+
+if __name__ == "__main__":
+    from cache import StageCache
+
+    run_scene('best_model.pth', "sentinel_rgb_10m_5000_voronezh.tif",
+              "crops_final.geojson", batch_size=64, cache=StageCache('.cache'))
@@ -0,0 +1,209 @@
+import json
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+import shapely
+from rasterio.features import shapes
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from vector_io import layer_format, write_layer
+
+
+def iter_mask_bands(mask, band_height=1024):
+    for y in range(0, mask.shape[0], band_height):
+        yield y, mask[y:y + band_height]
+
+
+def iter_probability_bands(probability_path, threshold=0.9995, band_height=1024, overview_level=None):
+    with rasterio.open(probability_path, overview_level=overview_level) as src:
+        for y in range(0, src.height, band_height):
+            rows = min(band_height, src.height - y)
+            probability = src.read(1, window=Window(0, y, src.width, rows))
+            yield y, (probability > threshold).astype(np.uint8)
+
+
+def band_polygons(band_mask, transform):
+    """Polygonizes one band and builds the shapely array in bulk.
+
+    Ring coordinates from ``rasterio.features.shapes`` are concatenated
+    and turned into rings and polygons with two vectorized shapely calls
+    instead of one ``shape()`` call per feature.
+    """
+    coords = []
+    ring_index = []
+    polygon_index = []
+
+    n_rings = 0
+    n_polygons = 0
+    for geom, _ in shapes(band_mask, mask=band_mask, transform=transform):
+        for ring in geom['coordinates']:
+            coords.append(np.asarray(ring, dtype=np.float64))
+            ring_index.append(np.full(len(ring), n_rings))
+            polygon_index.append(n_polygons)
+            n_rings += 1
+        n_polygons += 1
+
+    if n_polygons == 0:
+        return np.empty(0, dtype=object)
+
+    rings = shapely.linearrings(np.concatenate(coords),
+                                indices=np.concatenate(ring_index))
+    return shapely.polygons(rings, indices=np.asarray(polygon_index))
+
+
+def seam_line(transform, row, width):
+    return shapely.linestrings([transform * (0, row), transform * (width, row)])
+
+
+def merge_across_seam(above, below):
+    """Unions polygons that share an edge across a band seam.
+
+    ``shapes`` uses 4-connectivity, so polygons that only meet at a corner
+    stay separate, as they would in a single full-scene pass.
+    """
+    candidates = np.concatenate([above, below])
+    if len(above) == 0 or len(below) == 0:
+        return candidates
+
+    parent = np.arange(len(candidates))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    tree = shapely.STRtree(below)
+    i_above, i_below = tree.query(above, predicate='intersects')
+    shared = shapely.length(shapely.intersection(
+        above[i_above], below[i_below])) > 0
+
+    for a, b in zip(i_above[shared], i_below[shared] + len(above)):
+        parent[find(a)] = find(b)
+
+    roots = np.array([find(i) for i in range(len(candidates))])
+    merged = []
+    for root in np.unique(roots):
+        members = candidates[roots == root]
+        merged.append(members[0] if len(members) == 1
+                      else shapely.union_all(members))
+    return np.array(merged, dtype=object)
+
+
+def iter_stitched_polygons(bands, transform, width, height):
+    """Yields arrays of finished polygons band by band.
+
+    Polygons touching the bottom seam of a band are held back. They are
+    merged with the polygons touching the top seam of the next band, so
+    peak memory is one band plus the polygons along one seam.
+    """
+    pending = np.empty(0, dtype=object)
+
+    for y, band_mask in bands:
+        band_transform = transform * Affine.translation(0, y)
+        polygons = band_polygons(band_mask, band_transform)
+
+        if len(pending):
+            top = shapely.intersects(polygons, seam_line(transform, y, width))
+            polygons = np.concatenate(
+                [merge_across_seam(pending, polygons[top]), polygons[~top]])
+
+        y_end = y + band_mask.shape[0]
+        if y_end < height and len(polygons):
+            bottom = shapely.intersects(
+                polygons, seam_line(transform, y_end, width))
+            pending = polygons[bottom]
+            polygons = polygons[~bottom]
+        else:
+            pending = np.empty(0, dtype=object)
+
+        if len(polygons):
+            yield polygons
+
+    if len(pending):
+        yield pending
+
+
+class GeoJSONWriter:
+    """Streams features to a GeoJSON FeatureCollection.
+
+    Geometry strings come from the vectorized ``shapely.to_geojson``. The
+    file is created on the first write, so an empty result leaves no file,
+    matching the old behaviour. The CRS is recorded as a named "crs"
+    member, as GDAL writes it (or its WKT when it has no EPSG code), so
+    ``gpd.read_file`` restores it.
+    """
+
+    def __init__(self, path, crs=None, properties=None):
+        self.path = path
+        self.crs = crs
+        self.properties = json.dumps(properties or {}, ensure_ascii=False)
+        self.count = 0
+        self._file = None
+
+    def _open(self):
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write('{"type": "FeatureCollection",\n')
+        if self.crs:
+            # A CRS without an EPSG code is named by its WKT, which GDAL also
+            # accepts, so projected coordinates are never read as WGS84.
+            epsg = self.crs.to_epsg()
+            name = f"urn:ogc:def:crs:EPSG::{epsg}" if epsg else self.crs.to_wkt()
+            self._file.write(
+                '"crs": {"type": "name", "properties": '
+                f'{{"name": {json.dumps(name)}}}}},\n')
+        self._file.write('"features": [\n')
+
+    def write(self, geometries):
+        if len(geometries) == 0:
+            return
+        if self._file is None:
+            self._open()
+
+        for geometry in shapely.to_geojson(geometries):
+            if self.count:
+                self._file.write(',\n')
+            self._file.write(
+                f'{{"type": "Feature", "properties": {self.properties}, "geometry": {geometry}}}')
+            self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.write('\n]}\n')
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def polygonize_to_geojson(bands, transform, crs, width, height, output_path):
+    with GeoJSONWriter(output_path, crs=crs, properties={'class': 'PermanentCrop'}) as writer:
+        for polygons in iter_stitched_polygons(bands, transform, width, height):
+            writer.write(polygons)
+    return writer.count
+
+
+def polygonize_to_file(bands, transform, crs, width, height, output_path):
+    """Polygonizes into GeoJSON, GeoParquet or FlatGeobuf, by the file extension.
+
+    GeoJSON is streamed feature by feature. The binary formats collect the
+    stitched polygons, which are small next to the mask, and write them in
+    one go. As with GeoJSON, an empty result leaves no file.
+    """
+    if layer_format(output_path) == 'GeoJSON':
+        return polygonize_to_geojson(bands, transform, crs, width, height, output_path)
+
+    polygons = list(iter_stitched_polygons(bands, transform, width, height))
+    if not polygons:
+        return 0
+
+    geometry = np.concatenate(polygons)
+    write_layer(gpd.GeoDataFrame({'class': ['PermanentCrop'] * len(geometry)},
+                                 geometry=geometry, crs=crs), output_path)
+    return len(geometry)
@@ -1,95 +1,451 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import rasterio
+import rasterio.shutil
 from rasterio.windows import Window
-from rasterio.features import shapes
 import geopandas as gpd
 import cv2
 import numpy as np
 import torch
-import segmentation_models_pytorch as smp
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
 
+from backends import load_backend
+from blending import BlendWeights
+from polygonize import iter_mask_bands, iter_probability_bands, iter_stitched_polygons, polygonize_to_file
+from raster_cache import CachedRaster
+from screen import TileScreen
 
-def predict_large_image(model_path, large_image_path, output_geojson_path, patch_size=64, stride=35):
 
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+def iter_windows(h, w, patch_size, stride):
+    for y in range(0, h, stride):
+        for x in range(0, w, stride):
+            y_end = min(y + patch_size, h)
+            x_end = min(x + patch_size, w)
+            yield x, y, x_end - x, y_end - y
+
+
+def prepare_patch(window_data, patch_size):
+    img_patch = window_data.transpose(1, 2, 0)
+
+    if img_patch.shape[2] > 3:
+        img_patch = img_patch[:, :, :3]
+
+    win_h, win_w = img_patch.shape[:2]
+    pad_y = patch_size - win_h
+    pad_x = patch_size - win_w
+
+    if pad_x > 0 or pad_y > 0:
+        img_patch = cv2.copyMakeBorder(
+            img_patch, 0, pad_y, 0, pad_x, cv2.BORDER_REFLECT)
+
+    return img_patch
+
+
+def predict_batch(model, preprocess, patches, device):
+    """Runs the network on a list of HWC patches in one forward pass.
+
+    Returns:
+        np.ndarray: Probabilities of shape (N, patch_size, patch_size).
+    """
+    batch = torch.stack([preprocess(image=p)['image'] for p in patches])
+
+    with torch.no_grad():
+        prediction = model(batch.to(device))
+
+    return prediction[:, 0].cpu().numpy()
+
+
+def predict_probability(model, preprocess, src, device, patch_size=64, stride=35, batch_size=1, window='uniform',
+                        screen=None):
+    h, w = src.height, src.width
+
+    weights = BlendWeights(h, w, patch_size, stride, window=window)
+
+    full_mask = np.zeros((h, w), dtype=np.float32)
+
+    windows = []
+    patches = []
+
+    def flush():
+        predictions = predict_batch(model, preprocess, patches, device)
+
+        for (x, y, win_w, win_h), prediction in zip(windows, predictions):
+            full_mask[y:y + win_h, x:x + win_w] += (
+                prediction[:win_h, :win_w] * weights.patch(x, y, win_w, win_h))
+
+        windows.clear()
+        patches.clear()
+
+    for x, y, win_w, win_h in iter_windows(h, w, patch_size, stride):
+        window_data = src.read(window=Window(x, y, win_w, win_h))
+
+        if screen is not None and screen.is_empty(window_data):
+            continue
+
+        windows.append((x, y, win_w, win_h))
+        patches.append(prepare_patch(window_data, patch_size))
+
+        if len(patches) >= batch_size:
+            flush()
+
+    if patches:
+        flush()
+
+    return full_mask
+
+
+def iter_probability_rows(model, preprocess, src, device, patch_size=64, stride=35, batch_size=1,
+                          window='uniform', screen=None):
+    """Streams the blended probability map top to bottom.
+
+    Only a (patch_size, width) accumulation band is kept in memory. Each
+    row of windows is read from ``src`` as one strip; rows above the next
+    window row can no longer receive predictions and are yielded as soon
+    as that row starts.
+
+    Yields:
+        tuple: (row_offset, np.ndarray of finished float32 rows).
+    """
+    h, w = src.height, src.width
+
+    weights = BlendWeights(h, w, patch_size, stride, window=window)
+
+    band_sum = np.zeros((patch_size, w), dtype=np.float32)
+    base = 0
+
+    for y in range(0, h, stride):
+        done = min(y - base, patch_size)
+        if done > 0:
+            yield base, band_sum[:done].copy()
+
+            band_sum[:patch_size - done] = band_sum[done:]
+            band_sum[patch_size - done:] = 0
+
+        if y - base > patch_size:
+            yield base + patch_size, np.zeros((y - base - patch_size, w), dtype=np.float32)
+
+        base = y
+        band_h = min(patch_size, h - y)
+        band = src.read(window=Window(0, y, w, band_h))
+
+        windows = [(x, min(x + patch_size, w)) for x in range(0, w, stride)]
+        if screen is not None:
+            windows = [(x, x_end) for x, x_end in windows
+                       if not screen.is_empty(band[:, :, x:x_end])]
+
+        for i in range(0, len(windows), batch_size):
+            chunk = windows[i:i + batch_size]
+            patches = [prepare_patch(band[:, :, x:x_end], patch_size)
+                       for x, x_end in chunk]
+            predictions = predict_batch(model, preprocess, patches, device)
+
+            for (x, x_end), prediction in zip(chunk, predictions):
+                band_sum[:band_h, x:x_end] += (
+                    prediction[:band_h, :x_end - x] * weights.patch(x, y, x_end - x, band_h))
+
+    if base < h:
+        rest = min(h - base, patch_size)
+        yield base, band_sum[:rest].copy()
+
+    if h - base > patch_size:
+        yield base + patch_size, np.zeros((h - base - patch_size, w), dtype=np.float32)
+
+
+_worker = {}
+
+
+def _init_worker(model_path, image_path, num_threads, backend):
+    torch.set_num_threads(num_threads)
+    _worker['model'] = load_backend(
+        model_path, 'cpu', backend=backend, num_threads=num_threads)
+    _worker['preprocess'] = build_preprocess()
+    _worker['src'] = rasterio.open(image_path)
 
-    model = smp.Unet(encoder_name="resnet34", classes=1,
-                     activation='sigmoid')
-    model.load_state_dict(torch.load(model_path))
-    model.to(device)
-    model.eval()
 
-    preprocess = A.Compose([
+def _predict_strip(row_starts, patch_size, stride, batch_size, window, screen):
+    src = _worker['src']
+    h, w = src.height, src.width
+    weights = BlendWeights(h, w, patch_size, stride, window=window)
+
+    y0 = row_starts[0]
+    y1 = min(row_starts[-1] + patch_size, h)
+    strip = src.read(window=Window(0, y0, w, y1 - y0))
+    partial = np.zeros((y1 - y0, w), dtype=np.float32)
+
+    starts = set(row_starts)
+    windows = [(x, y, win_w, win_h)
+               for x, y, win_w, win_h in iter_windows(h, w, patch_size, stride)
+               if y in starts]
+    counters = (0, 0)
+    if screen is not None:
+        # The screen is a copy pickled with the task, possibly after the
+        # parent already added other strips' counters; return only this strip's.
+        checked, skipped = screen.checked, screen.skipped
+        windows = [(x, y, win_w, win_h) for x, y, win_w, win_h in windows
+                   if not screen.is_empty(strip[:, y - y0:y - y0 + win_h, x:x + win_w])]
+        counters = (screen.checked - checked, screen.skipped - skipped)
+
+    for i in range(0, len(windows), batch_size):
+        chunk = windows[i:i + batch_size]
+        patches = [prepare_patch(strip[:, y - y0:y - y0 + win_h, x:x + win_w], patch_size)
+                   for x, y, win_w, win_h in chunk]
+        predictions = predict_batch(
+            _worker['model'], _worker['preprocess'], patches, 'cpu')
+
+        for (x, y, win_w, win_h), prediction in zip(chunk, predictions):
+            partial[y - y0:y - y0 + win_h, x:x + win_w] += (
+                prediction[:win_h, :win_w] * weights.patch(x, y, win_w, win_h))
+
+    return y0, partial, counters
+
+
+def predict_probability_parallel(model_path, image_path, patch_size=64, stride=35, batch_size=1, window='uniform',
+                                 workers=None, strips_per_worker=4, backend='eager', screen=None):
+    """Runs the sliding-window scan in a pool of CPU worker processes.
+
+    The scene is cut into horizontal strips of whole window rows. Each
+    worker loads the model and opens the raster once. For every strip it
+    returns the weighted partial sum of its windows. Blend weights are
+    normalized globally, so merging the overlapping partial maps is a
+    plain sum. The result matches ``predict_probability``.
+    """
+    workers = workers or os.cpu_count()
+
+    with rasterio.open(image_path) as src:
+        h, w = src.height, src.width
+
+    row_starts = list(range(0, h, stride))
+    n_strips = min(len(row_starts), workers * strips_per_worker)
+    strips = [[int(y) for y in chunk] for chunk in np.array_split(row_starts, n_strips)]
+
+    full_mask = np.zeros((h, w), dtype=np.float32)
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(model_path, image_path, num_threads, backend)) as pool:
+        futures = [pool.submit(_predict_strip, strip, patch_size, stride, batch_size, window, screen)
+                   for strip in strips]
+
+        for future in as_completed(futures):
+            y0, partial, (checked, skipped) = future.result()
+            full_mask[y0:y0 + partial.shape[0]] += partial
+            if screen is not None:
+                screen.checked += checked
+                screen.skipped += skipped
+
+    return full_mask
+
+
+def write_probability_raster(rows, profile, output_path, cog=True):
+    """Writes probability rows into a tiled float32 GeoTIFF.
+
+    With ``cog`` the rows go to a temporary tiled GeoTIFF first and are
+    then copied by GDAL's COG driver, which adds averaged overviews and
+    puts them ahead of the full-resolution tiles. Viewers and
+    ``rethreshold`` can then read any window or zoom level without
+    scanning the whole file.
+    """
+    profile = profile.copy()
+    profile.update(
+        driver='GTiff',
+        count=1,
+        dtype='float32',
+        nodata=None,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress='deflate',
+        predictor=3,
+        BIGTIFF='IF_SAFER',
+    )
+    profile.pop('photometric', None)
+
+    tiff_path = output_path + '.tmp.tif' if cog else output_path
+
+    with rasterio.open(tiff_path, 'w', **profile) as dst:
+        for row_offset, probability in rows:
+            dst.write(probability, 1, window=Window(
+                0, row_offset, probability.shape[1], probability.shape[0]))
+
+    if cog:
+        try:
+            rasterio.shutil.copy(
+                tiff_path, output_path, driver='COG', compress='DEFLATE', predictor='YES',
+                blocksize=256, overview_resampling='AVERAGE', bigtiff='IF_SAFER')
+        finally:
+            os.remove(tiff_path)
+
+    return output_path
+
+
+def build_preprocess():
+    return A.Compose([
         A.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
         ToTensorV2()
     ])
 
-    with rasterio.open(large_image_path) as src:
-        h, w = src.height, src.width
-        profile = src.profile
-        transform = src.transform
-
-        full_mask = np.zeros((h, w), dtype=np.float32)
 
-        count_mask = np.zeros((h, w), dtype=np.float32)
+def _removing_after(bands, path):
+    try:
+        yield from bands
+    finally:
+        os.remove(path)
 
-        for y in range(0, h, stride):
-            for x in range(0, w, stride):
-                y_end = min(y + patch_size, h)
-                x_end = min(x + patch_size, w)
 
-                win_h = y_end - y
-                win_w = x_end - x
+def predict_mask(model_path, large_image_path, patch_size=64, stride=35, batch_size=1,
+                 cache_raster=True, streaming=False, probability_path=None, window='uniform',
+                 threshold=0.9995, workers=1, backend='eager', skip_empty=True, model=None, cache=None):
+    """Runs inference over a scene and thresholds the blended probabilities.
 
-                window_data = src.read(window=Window(x, y, win_w, win_h))
+    With ``probability_path`` the blended probabilities are also saved as
+    a Cloud-Optimized GeoTIFF, so ``rethreshold`` can polygonize other
+    thresholds without inference. With a ``StageCache`` the probability
+    raster is stored under a key of the scene and weights digests and the
+    inference parameters. A rerun with only a new ``threshold`` reads it
+    back instead of running the U-Net.
 
-                img_patch = window_data.transpose(1, 2, 0)
+    ``workers`` > 1 loads the model from ``model_path`` in every worker
+    process, so it cannot be combined with a preloaded ``model``.
 
-                if img_patch.shape[2] > 3:
-                    img_patch = img_patch[:, :, :3]
+    Returns:
+        tuple: (bands, transform, crs, width, height), where ``bands``
+        yields (row_offset, uint8 mask rows) for ``polygonize``.
+    """
+    if streaming and probability_path is None:
+        raise ValueError("streaming=True needs a probability_path")
+    if model is not None and workers > 1:
+        raise ValueError("workers > 1 loads the model from model_path in each process; "
+                         "it cannot be used with a preloaded model")
 
-                pad_y = patch_size - win_h
-                pad_x = patch_size - win_w
+    screen = TileScreen() if skip_empty else None
 
-                if pad_x > 0 or pad_y > 0:
-                    img_patch = cv2.copyMakeBorder(
-                        img_patch, 0, pad_y, 0, pad_x, cv2.BORDER_REFLECT)
+    probability_key = None
+    if cache is not None and model_path is not None:
+        probability_key = cache.key('probability', (large_image_path, model_path), {
+            'patch_size': patch_size, 'stride': stride, 'window': window,
+            'backend': backend, 'skip_empty': bool(skip_empty),
+            'screen': screen.rules() if screen is not None else None})
+        # The entry itself may be evicted by another worker while polygonize
+        # reads it lazily, so read a checked-out copy or link instead.
+        checkout_path = probability_path or cache.tmp_path('.tif')
+        if cache.get(probability_key, '.tif', checkout_path) is not None:
+            print(f" Карта вероятностей взята из кэша: {checkout_path}")
+            with rasterio.open(checkout_path) as src:
+                transform, crs, w, h = src.transform, src.crs, src.width, src.height
+            bands = iter_probability_bands(checkout_path, threshold=threshold)
+            if probability_path is None:
+                bands = _removing_after(bands, checkout_path)
+            return bands, transform, crs, w, h
+        if probability_path is None:
+            os.remove(checkout_path)
 
-                augmented = preprocess(image=img_patch)
-                input_tensor = augmented['image'].unsqueeze(0).to(device)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-                with torch.no_grad():
-                    prediction = model(input_tensor)
-                    prediction = prediction.squeeze().cpu().numpy()
+    if model is None and (streaming or workers <= 1):
+        model = load_backend(model_path, device, backend=backend)
+    preprocess = build_preprocess()
 
-                valid_pred = prediction[:win_h, :win_w]
+    with rasterio.open(large_image_path) as src:
+        transform = src.transform
+        crs = src.crs
+        profile = src.profile
+        h, w = src.height, src.width
 
-                full_mask[y:y_end, x:x_end] += valid_pred
-                count_mask[y:y_end, x:x_end] += 1
+        if screen is not None:
+            screen.nodata = src.nodata if src.nodata is not None else 0
 
-        final_probability = full_mask / np.maximum(count_mask, 1)
+        if streaming:
+            rows = iter_probability_rows(
+                model, preprocess, src, device,
+                patch_size=patch_size, stride=stride, batch_size=batch_size,
+                window=window, screen=screen)
+            write_probability_raster(rows, src.profile, probability_path)
+            print(f" Карта вероятностей сохранена в {probability_path}")
+        elif model is None:
+            final_probability = predict_probability_parallel(
+                model_path, large_image_path,
+                patch_size=patch_size, stride=stride, batch_size=batch_size,
+                window=window, workers=workers, backend=backend, screen=screen)
+        else:
+            if cache_raster:
+                reader = CachedRaster(
+                    src, indexes=range(1, min(src.count, 3) + 1))
+            else:
+                reader = src
 
-        binary_mask = (final_probability > 0.9995).astype(np.uint8)
+            try:
+                final_probability = predict_probability(
+                    model, preprocess, reader, device,
+                    patch_size=patch_size, stride=stride, batch_size=batch_size,
+                    window=window, screen=screen)
+            finally:
+                if cache_raster:
+                    reader.close()
 
-        results = (
-            {'properties': {'class': 'PermanentCrop'}, 'geometry': s}
-            for i, (s, v)
-            in enumerate(shapes(binary_mask, mask=binary_mask, transform=transform))
-        )
+    if screen is not None and screen.checked:
+        print(f" Пропущено пустых окон: {screen.skipped} из {screen.checked}")
 
-        geoms = list(results)
-        if len(geoms) > 0:
-            gdf = gpd.GeoDataFrame.from_features(geoms)
-            if src.crs:
-                gdf.crs = src.crs
+    if probability_path is not None and not streaming:
+        write_probability_raster([(0, final_probability)], profile, probability_path)
+        print(f" Карта вероятностей сохранена в {probability_path}")
 
-            gdf.to_file(output_geojson_path, driver='GeoJSON')
-            print(f" Сохранено в {output_geojson_path}")
+    if probability_key is not None:
+        if probability_path is not None:
+            cache.put(probability_key, '.tif', probability_path)
         else:
-            print("Не найдено объектов класса PermanentCrop.")
+            tmp_path = write_probability_raster(
+                [(0, final_probability)], profile, cache.tmp_path('.tif'))
+            cache.put(probability_key, '.tif', tmp_path, move=True)
+
+    if streaming:
+        bands = iter_probability_bands(probability_path, threshold=threshold)
+    else:
+        binary_mask = (final_probability > threshold).astype(np.uint8)
+        del final_probability
+        bands = iter_mask_bands(binary_mask)
+
+    return bands, transform, crs, w, h
+
+
+def predict_polygons(model_path, large_image_path, **kwargs):
+    """Same as ``predict_large_image`` but returns a GeoDataFrame in the image CRS."""
+    bands, transform, crs, w, h = predict_mask(
+        model_path, large_image_path, **kwargs)
+
+    polygons = list(iter_stitched_polygons(bands, transform, w, h))
+    geometry = np.concatenate(polygons) if polygons else []
+    return gpd.GeoDataFrame({'class': ['PermanentCrop'] * len(geometry)},
+                            geometry=geometry, crs=crs)
+
+
+def predict_large_image(model_path, large_image_path, output_geojson_path, streaming=False, probability_path=None,
+                        **kwargs):
+    if streaming and probability_path is None:
+        probability_path = os.path.splitext(
+            output_geojson_path)[0] + "_probability.tif"
+
+    bands, transform, crs, w, h = predict_mask(
+        model_path, large_image_path, streaming=streaming,
+        probability_path=probability_path, **kwargs)
+
+    count = polygonize_to_file(
+        bands, transform, crs, w, h, output_geojson_path)
+    if count > 0:
+        print(f" Сохранено в {output_geojson_path}")
+    else:
+        print("Не найдено объектов класса PermanentCrop.")
+
 
+if __name__ == "__main__":
+    from cache import StageCache
 
-large_image_path = "sentinel_rgb_10m_5000_voronezh.tif"
-predict_large_image('best_model.pth',
-                    large_image_path, 'output_crops_voronezh.geojson')
+    large_image_path = "sentinel_rgb_10m_5000_voronezh.tif"
+    predict_large_image('best_model.pth',
+                        large_image_path, 'output_crops_voronezh.geojson',
+                        batch_size=64, probability_path='probability_voronezh.tif',
+                        cache=StageCache('.cache'))
@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+import numpy as np
+
+
+MEMMAP_THRESHOLD_BYTES = 512 * 1024 ** 2
+
+
+class CachedRaster:
+    """Decodes a raster once, block by block, and serves windows as views.
+
+    Each internal block (or strip) of the GeoTIFF is read exactly once into
+    a (bands, height, width) array. Scenes larger than
+    ``memmap_threshold_bytes`` are decoded into a temporary memory-mapped
+    file instead of RAM. ``read(window=...)`` mirrors ``DatasetReader.read``
+    but returns a zero-copy view into the decoded array.
+
+    Args:
+        src (rasterio.DatasetReader): An open raster.
+        indexes (list[int], optional): Bands to cache. Defaults to all bands.
+        memmap_threshold_bytes (int): Size above which a memmap is used.
+        tmp_dir (str, optional): Directory for the memmap file.
+    """
+
+    def __init__(self, src, indexes=None, memmap_threshold_bytes=MEMMAP_THRESHOLD_BYTES, tmp_dir=None):
+        self.indexes = list(indexes or range(1, src.count + 1))
+        self.height = src.height
+        self.width = src.width
+        self.transform = src.transform
+        self.crs = src.crs
+
+        shape = (len(self.indexes), self.height, self.width)
+        dtype = np.dtype(src.dtypes[self.indexes[0] - 1])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+
+        self._memmap_path = None
+        if nbytes > memmap_threshold_bytes:
+            fd, self._memmap_path = tempfile.mkstemp(
+                suffix='.dat', dir=tmp_dir)
+            os.close(fd)
+            self.data = np.memmap(self._memmap_path, dtype=dtype,
+                                  mode='w+', shape=shape)
+        else:
+            self.data = np.empty(shape, dtype=dtype)
+
+        for _, window in src.block_windows(self.indexes[0]):
+            rows, cols = window.toslices()
+            self.data[:, rows, cols] = src.read(self.indexes, window=window)
+
+    def read(self, window):
+        rows, cols = window.toslices()
+        return self.data[:, rows, cols]
+
+    def close(self):
+        if self._memmap_path is not None:
+            del self.data
+            os.remove(self._memmap_path)
+            self._memmap_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,11 +1,132 @@
-import geopandas as gpd
+import numpy as np
 import rasterio
+import shapely
 import matplotlib.pyplot as plt
+from rasterio.enums import MaskFlags
+from rasterio.features import shapes
+from rasterio.transform import Affine
+from rasterio.warp import calculate_default_transform, transform_geom
+
+from vector_io import read_layer, write_layer
+
+
+def remove_border(gdf, img_bounds, img_crs, res, margin_pixels=10):
+    """Drops polygons closer than margin_pixels to the scene edge.
+
+    The test is done on bounds in the image CRS. When ``gdf`` is in another
+    CRS, only its geometry is reprojected for the test, and the returned
+    layer keeps the CRS of ``gdf``.
+    """
+    res_x, res_y = res
+    # Pixel-aligned polygons can sit exactly on the safe edge; allow a
+    # micro-pixel of reprojection noise so they are kept as before.
+    margin_x = margin_pixels * res_x - 1e-6 * res_x
+    margin_y = margin_pixels * res_y - 1e-6 * res_y
+
+    safe_left = img_bounds.left + margin_x
+    safe_right = img_bounds.right - margin_x
+    safe_bottom = img_bounds.bottom + margin_y
+    safe_top = img_bounds.top - margin_y
+
+    geometry = gdf.geometry
+    if gdf.crs is not None and img_crs is not None and gdf.crs != img_crs:
+        geometry = geometry.to_crs(img_crs)
+
+    poly_bounds = geometry.bounds
+
+    mask_touching_edge = (
+        (poly_bounds['minx'] < safe_left) |
+        (poly_bounds['maxx'] > safe_right) |
+        (poly_bounds['miny'] < safe_bottom) |
+        (poly_bounds['maxy'] > safe_top)
+    )
+
+    return gdf[~mask_touching_edge].copy()
+
+
+def scene_footprint(tiff_path, crs=None, max_size=2048):
+    """Valid-data outline of a scene and its pixel size, in ``crs``.
+
+    Scenes without nodata or a mask use their bounds. Otherwise the outline
+    is traced from the dataset mask, read at no more than ``max_size``
+    pixels per side.
+
+    Returns:
+        tuple: (shapely polygon, pixel size in ``crs`` units).
+    """
+    with rasterio.open(tiff_path) as src:
+        crs = crs or src.crs
+        all_valid = all(MaskFlags.all_valid in flags for flags in src.mask_flag_enums)
+
+        if all_valid:
+            footprint = shapely.box(*src.bounds)
+        else:
+            factor = max(1, max(src.width, src.height) / max_size)
+            out_shape = (max(1, round(src.height / factor)), max(1, round(src.width / factor)))
+            mask = src.dataset_mask(out_shape=out_shape)
+            transform = src.transform * Affine.scale(src.width / out_shape[1], src.height / out_shape[0])
+            footprint = shapely.union_all([
+                shapely.geometry.shape(geom)
+                for geom, _ in shapes(mask, mask=mask > 0, transform=transform)])
+            footprint = shapely.simplify(footprint, transform.a / 2)
+
+        res = src.res[0]
+        if crs != src.crs:
+            footprint = shapely.segmentize(footprint, 64 * src.res[0])
+            footprint = shapely.geometry.shape(transform_geom(src.crs, crs, shapely.geometry.mapping(footprint)))
+            res = calculate_default_transform(src.crs, crs, src.width, src.height, *src.bounds)[0].a
+
+    return footprint, res
+
+
+class FootprintIndex:
+    """Edges of a mosaic of scene footprints, for dropping polygons cut by them.
+
+    Footprints are unioned, so seams between neighbouring scenes are
+    interior and do not count as edges. The outer outline is split into
+    segments held in an STRtree, and one bulk ``dwithin`` query classifies
+    every polygon at once. Everything is in the CRS of the polygon layer,
+    so polygons are never reprojected.
+    """
+
+    def __init__(self, footprints, crs, res):
+        self.crs = crs
+        self.res = res
+        self.footprints = np.asarray(footprints, dtype=object)
+        self.mosaic = shapely.union_all(self.footprints)
+
+        coords, ring_index = shapely.get_coordinates(
+            shapely.get_parts(shapely.boundary(self.mosaic)), return_index=True)
+        same_ring = ring_index[:-1] == ring_index[1:]
+        self.edges = shapely.linestrings(
+            np.stack([coords[:-1][same_ring], coords[1:][same_ring]], axis=1))
+        self.tree = shapely.STRtree(self.edges)
+
+    @classmethod
+    def from_scenes(cls, tiff_paths, crs, max_size=2048):
+        footprints, resolutions = zip(*[scene_footprint(path, crs, max_size) for path in tiff_paths])
+        return cls(footprints, crs, max(resolutions))
+
+    def edge_mask(self, geometries, margin_pixels=10):
+        """True for geometries within ``margin_pixels`` of the mosaic edge or outside it."""
+        geometries = np.asarray(geometries, dtype=object)
+        margin = margin_pixels * self.res - 1e-6 * self.res
+
+        touching = np.zeros(len(geometries), dtype=bool)
+        hits, _ = self.tree.query(geometries, predicate='dwithin', distance=margin)
+        touching[hits] = True
+        touching |= ~shapely.within(geometries, self.mosaic)
+        return touching
+
+    def remove_border(self, gdf, margin_pixels=10):
+        if gdf.crs is not None and self.crs is not None and gdf.crs != self.crs:
+            raise ValueError(f"Layer CRS {gdf.crs} differs from the footprint index CRS {self.crs}")
+        return gdf[~self.edge_mask(gdf.geometry.to_numpy(), margin_pixels)].copy()
 
 
 def remove_border_polygons(input_geojson, tiff_path, output_geojson, margin_pixels=10):
     try:
-        gdf = gpd.read_file(input_geojson)
+        gdf = read_layer(input_geojson)
     except Exception as e:
         print(f"Ошибка чтения GeoJSON: {e}")
         return
@@ -25,30 +146,7 @@ def remove_border_polygons(input_geojson, tiff_path, output_geojson, margin_pixe
         print(f"Ошибка чтения TIFF: {e}")
         return
 
-    original_crs = gdf.crs
-
-    if gdf.crs != img_crs:
-        print("   Приведение GeoJSON к системе координат снимка...")
-        gdf = gdf.to_crs(img_crs)
-
-    margin_x = margin_pixels * res_x
-    margin_y = margin_pixels * res_y
-
-    safe_left = img_bounds.left + margin_x
-    safe_right = img_bounds.right - margin_x
-    safe_bottom = img_bounds.bottom + margin_y
-    safe_top = img_bounds.top - margin_y
-
-    poly_bounds = gdf.bounds
-
-    mask_touching_edge = (
-        (poly_bounds['minx'] < safe_left) |
-        (poly_bounds['maxx'] > safe_right) |
-        (poly_bounds['miny'] < safe_bottom) |
-        (poly_bounds['maxy'] > safe_top)
-    )
-
-    clean_gdf = gdf[~mask_touching_edge].copy()
+    clean_gdf = remove_border(gdf, img_bounds, img_crs, (res_x, res_y), margin_pixels)
 
     original_count = len(gdf)
     clean_count = len(clean_gdf)
@@ -58,11 +156,40 @@ def remove_border_polygons(input_geojson, tiff_path, output_geojson, margin_pixe
     print(f"   Удалено на краях: {removed}")
     print(f"   Осталось: {clean_count}")
 
-    if original_crs is not None and original_crs != clean_gdf.crs:
-        clean_gdf = clean_gdf.to_crs(original_crs)
+    if not clean_gdf.empty:
+        write_layer(clean_gdf, output_geojson)
+        print(f"Сохранено в: {output_geojson}")
+    else:
+        print("Внимание: Все полигоны были удалены (возможно, слишком большой отступ?)")
+
+
+def remove_mosaic_border_polygons(input_geojson, tiff_paths, output_geojson, margin_pixels=10):
+    """Same as ``remove_border_polygons`` for a mosaic of scenes: only the outer edge counts."""
+    try:
+        gdf = read_layer(input_geojson)
+    except Exception as e:
+        print(f"Ошибка чтения GeoJSON: {e}")
+        return
+
+    if gdf.empty:
+        print("GeoJSON пуст.")
+        return
+
+    try:
+        index = FootprintIndex.from_scenes(tiff_paths, gdf.crs)
+    except Exception as e:
+        print(f"Ошибка чтения TIFF мозаики: {e}")
+        return
+
+    clean_gdf = index.remove_border(gdf, margin_pixels)
+
+    print(f"   Снимков в мозаике: {len(tiff_paths)}")
+    print(f"   Было полигонов: {len(gdf)}")
+    print(f"   Удалено на краях мозаики: {len(gdf) - len(clean_gdf)}")
+    print(f"   Осталось: {len(clean_gdf)}")
 
     if not clean_gdf.empty:
-        clean_gdf.to_file(output_geojson, driver='GeoJSON')
+        write_layer(clean_gdf, output_geojson)
         print(f"Сохранено в: {output_geojson}")
     else:
         print("Внимание: Все полигоны были удалены (возможно, слишком большой отступ?)")
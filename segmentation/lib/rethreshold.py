@@ -0,0 +1,52 @@
+import argparse
+import os
+import time
+
+import rasterio
+
+from polygonize import iter_probability_bands, polygonize_to_file
+
+
+def rethreshold(probability_path, output_geojson_path, threshold=0.9995, band_height=1024, overview_level=None):
+    """Polygonizes a saved probability raster at a new threshold.
+
+    The raster is read in windows of ``band_height`` rows, so only one band
+    is in memory. ``overview_level`` reads a COG overview instead of the full
+    resolution for a quick coarse preview.
+
+    Returns:
+        int: Number of written polygons.
+    """
+    with rasterio.open(probability_path, overview_level=overview_level) as src:
+        transform, crs, w, h = src.transform, src.crs, src.width, src.height
+
+    bands = iter_probability_bands(probability_path, threshold=threshold,
+                                   band_height=band_height, overview_level=overview_level)
+    return polygonize_to_file(bands, transform, crs, w, h, output_geojson_path)
+
+
+def threshold_output_path(output_geojson_path, threshold):
+    root, ext = os.path.splitext(output_geojson_path)
+    return f"{root}_{threshold:g}{ext}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Полигонизация сохранённой карты вероятностей с новым порогом")
+    parser.add_argument('probability')
+    parser.add_argument('output')
+    parser.add_argument('--threshold', type=float, nargs='+', default=[0.9995])
+    parser.add_argument('--band-height', type=int, default=1024)
+    parser.add_argument('--overview-level', type=int, default=None,
+                        help="Уровень обзора COG для быстрого предпросмотра")
+    args = parser.parse_args()
+
+    for threshold in args.threshold:
+        output_path = args.output
+        if len(args.threshold) > 1:
+            output_path = threshold_output_path(args.output, threshold)
+
+        start = time.perf_counter()
+        count = rethreshold(args.probability, output_path, threshold,
+                            band_height=args.band_height, overview_level=args.overview_level)
+        print(f"Порог {threshold:g}: {count} полигонов за {time.perf_counter() - start:.2f} с -> {output_path}")
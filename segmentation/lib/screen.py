@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class TileScreen:
+    """Cheap per-window statistics used to skip the network on empty tiles.
+
+    By default a window is skipped only when it has no valid pixel at all
+    (cloud-masked or outside the export region). Skipped windows add
+    nothing to the blended map, but ``BlendWeights`` still counts their
+    weight, so only nodata pixels may lose probability and the mask on
+    valid pixels is unchanged. The other rules skip windows with valid
+    pixels and do change their probabilities; they are off by default.
+
+    Args:
+        nodata (float): Value written for masked pixels in every band.
+        max_nodata_fraction (float): Skip when at least this share of
+            pixels is nodata. 1.0 skips only windows without valid pixels.
+        min_std (float, optional): Skip when the standard deviation of every
+            band over valid pixels is below this (uniform fill, saturated
+            cloud). Disabled by default.
+        min_vegetation (float, optional): Skip when the largest normalized
+            excess-green index (2G - R - B) / (R + G + B) is below this.
+            Disabled by default.
+    """
+
+    def __init__(self, nodata=0, max_nodata_fraction=1.0, min_std=None, min_vegetation=None):
+        self.nodata = nodata
+        self.max_nodata_fraction = max_nodata_fraction
+        self.min_std = min_std
+        self.min_vegetation = min_vegetation
+        self.checked = 0
+        self.skipped = 0
+
+    def rules(self):
+        """Skip rules, for cache keys; ``nodata`` comes from the scene itself."""
+        return {'max_nodata_fraction': self.max_nodata_fraction, 'min_std': self.min_std,
+                'min_vegetation': self.min_vegetation}
+
+    def is_empty(self, window_data):
+        self.checked += 1
+        empty = self._is_empty(window_data)
+        self.skipped += empty
+        return empty
+
+    def _is_empty(self, window_data):
+        rgb = window_data[:3].astype(np.float32)
+
+        valid = ~np.isnan(rgb).any(axis=0)
+        if self.nodata is not None:
+            valid &= ~np.all(rgb == self.nodata, axis=0)
+
+        n_valid = valid.sum()
+        if n_valid <= (1 - self.max_nodata_fraction) * valid.size:
+            return True
+
+        pixels = rgb[:, valid]
+        if self.min_std is not None and pixels.std(axis=1).max() < self.min_std:
+            return True
+
+        if self.min_vegetation is not None:
+            r, g, b = pixels
+            exg = (2 * g - r - b) / np.maximum(r + g + b, 1e-6)
+            if exg.max() < self.min_vegetation:
+                return True
+
+        return False
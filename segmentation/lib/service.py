@@ -0,0 +1,274 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+import torch
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+
+from backends import BACKENDS, load_backend
+from predict import predict_large_image
+
+
+class MicroBatcher:
+    """Owns the warm model and merges patches from concurrent scenes into batches.
+
+    Scene jobs submit preprocessed (3, P, P) tensors. A single inference
+    thread takes up to ``batch_size`` of them, waiting at most
+    ``max_wait`` seconds to fill the batch. Patches of different sizes
+    (jobs with different ``patch_size``) go to separate forward passes. Each
+    patch's future is resolved with its (1, P, P) probability, or with the
+    exception of its forward pass; the thread itself keeps running.
+    """
+
+    def __init__(self, model, device, batch_size=64, max_wait=0.01):
+        self.model = model
+        self.device = device
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.patches = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, tensor):
+        future = Future()
+        self.queue.put((tensor, future))
+        return future
+
+    def _collect(self):
+        items = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run_batch(self, items):
+        groups = {}
+        for tensor, future in items:
+            groups.setdefault(tuple(tensor.shape), []).append((tensor, future))
+
+        for group in groups.values():
+            try:
+                batch = torch.stack([tensor for tensor, _ in group])
+                with torch.no_grad():
+                    prediction = self.model(batch.to(self.device)).cpu()
+            except Exception as e:
+                for _, future in group:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.patches += len(group)
+            for (_, future), result in zip(group, prediction):
+                future.set_result(result)
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                self._run_batch(items)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+class BatchedModel:
+    """Drop-in for the model in ``predict_batch`` that goes through a MicroBatcher."""
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def __call__(self, batch):
+        futures = [self.batcher.submit(tensor) for tensor in batch.cpu()]
+        return torch.stack([future.result() for future in futures])
+
+
+def resolve_data_path(data_root, path):
+    """Absolute ``path`` inside ``data_root``; relative paths are taken from the root.
+
+    Raises:
+        ValueError: If the path (after resolving symlinks and '..') is outside the root.
+    """
+    root = os.path.realpath(data_root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Path is outside the data directory: {path}")
+    return resolved
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class SceneJobCreate(BaseModel):
+    """Параметры задачи сегментации снимка"""
+    image_path: str
+    output_geojson_path: str
+    patch_size: int = Field(64, gt=0)
+    stride: int = Field(35, gt=0)
+    batch_size: int = Field(16, gt=0)
+    window: str = 'uniform'
+    threshold: float = Field(0.9995, gt=0, lt=1)
+    streaming: bool = False
+    skip_empty: bool = True
+
+
+class SceneJobResponse(BaseModel):
+    """Состояние задачи сегментации"""
+    id: str
+    status: JobStatus
+    image_path: str
+    output_geojson_path: str
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class SegmentationService:
+    """Keeps one model warm and runs scene jobs against it concurrently.
+
+    Job paths are resolved inside ``data_root``; the service reads and
+    writes nothing outside it.
+    """
+
+    def __init__(self, model_path, backend='eager', batch_size=64, max_wait=0.01, max_concurrent_scenes=4,
+                 data_root='.'):
+        self.data_root = os.path.realpath(data_root)
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        model = load_backend(model_path, self.device, backend=backend)
+        self.batcher = MicroBatcher(
+            model, self.device, batch_size=batch_size, max_wait=max_wait)
+        self.model = BatchedModel(self.batcher)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_scenes)
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, request):
+        image_path = resolve_data_path(self.data_root, request.image_path)
+        output_geojson_path = resolve_data_path(self.data_root, request.output_geojson_path)
+
+        job = SceneJobResponse(
+            id=uuid.uuid4().hex,
+            status=JobStatus.PENDING,
+            image_path=request.image_path,
+            output_geojson_path=request.output_geojson_path,
+            created_at=datetime.now(),
+        )
+        with self._lock:
+            self.jobs[job.id] = job
+
+        self.executor.submit(self._run, job, request, image_path, output_geojson_path)
+        return job
+
+    def _run(self, job, request, image_path, output_geojson_path):
+        job.status = JobStatus.RUNNING
+        job.started_at = datetime.now()
+        try:
+            predict_large_image(
+                None, image_path, output_geojson_path,
+                patch_size=request.patch_size, stride=request.stride,
+                batch_size=request.batch_size, window=request.window,
+                threshold=request.threshold, streaming=request.streaming,
+                skip_empty=request.skip_empty, model=self.model)
+            job.status = JobStatus.COMPLETED
+        except Exception as e:
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    backend = os.environ.get('SEGMENTATION_BACKEND', 'eager')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}, expected one of {BACKENDS}")
+
+    app.state.service = SegmentationService(
+        os.environ.get('SEGMENTATION_MODEL_PATH', 'best_model.pth'),
+        backend=backend,
+        batch_size=int(os.environ.get('SEGMENTATION_BATCH_SIZE', 64)),
+        max_concurrent_scenes=int(
+            os.environ.get('SEGMENTATION_MAX_SCENES', 4)),
+        data_root=os.environ.get('SEGMENTATION_DATA_ROOT', '.'),
+    )
+    yield
+    app.state.service.shutdown()
+
+
+app = FastAPI(title="Garden segmentation", lifespan=lifespan)
+
+
+@app.get("/health")
+def health():
+    service = app.state.service
+    return {
+        "device": service.device,
+        "queued_patches": service.batcher.queue.qsize(),
+        "batches": service.batcher.batches,
+        "patches": service.batcher.patches,
+    }
+
+
+@app.post("/jobs", response_model=SceneJobResponse, status_code=202)
+def create_job(request: SceneJobCreate):
+    try:
+        return app.state.service.submit(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/jobs", response_model=list[SceneJobResponse])
+def list_jobs():
+    return list(app.state.service.jobs.values())
+
+
+@app.get("/jobs/{job_id}", response_model=SceneJobResponse)
+def get_job(job_id: str):
+    job = app.state.service.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Сервис сегментации снимков с прогретой моделью")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Адрес для прослушивания; API без аутентификации, 0.0.0.0 только за прокси")
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--data-root', default=None,
+                        help="Каталог, вне которого задачи не читают и не пишут файлы")
+    args = parser.parse_args()
+
+    if args.data_root:
+        os.environ['SEGMENTATION_DATA_ROOT'] = args.data_root
+
+    uvicorn.run(app, host=args.host, port=args.port)
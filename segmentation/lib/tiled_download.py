@@ -0,0 +1,218 @@
+import argparse
+import math
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from xml.sax.saxutils import escape
+
+import rasterio
+from rasterio.merge import merge
+from rasterio.warp import transform_bounds
+
+Tile = namedtuple('Tile', ['row', 'col', 'bounds'])
+
+
+def utm_crs(lon, lat):
+    zone = int((lon + 180) // 6) + 1
+    return f"EPSG:{(32600 if lat >= 0 else 32700) + zone}"
+
+
+def split_aoi(bounds, crs, tile_size_m=10_000, scale=10):
+    """Cuts ``bounds`` (in a metric ``crs``) into a grid of export tiles.
+
+    Tile edges are snapped to multiples of ``scale``, so the exported
+    tiles share one pixel grid and mosaic without resampling.
+    """
+    tile_size_m = max(scale, tile_size_m // scale * scale)
+    minx = math.floor(bounds[0] / scale) * scale
+    miny = math.floor(bounds[1] / scale) * scale
+    maxx = math.ceil(bounds[2] / scale) * scale
+    maxy = math.ceil(bounds[3] / scale) * scale
+
+    tiles = []
+    for row, top in enumerate(range(maxy, miny, -tile_size_m)):
+        for col, left in enumerate(range(minx, maxx, tile_size_m)):
+            tiles.append(Tile(row, col, (left, max(top - tile_size_m, miny),
+                                         min(left + tile_size_m, maxx), top)))
+    return tiles
+
+
+def tile_path(tile_dir, tile):
+    return os.path.join(tile_dir, f"tile_{tile.row:03d}_{tile.col:03d}.tif")
+
+
+def is_complete(path):
+    if not os.path.exists(path):
+        return False
+    try:
+        with rasterio.open(path) as src:
+            return src.width > 0 and src.height > 0
+    except rasterio.errors.RasterioIOError:
+        return False
+
+
+def fetch_tile(client, tile, crs, scale, output_path, retries=4, backoff=2.0):
+    """Exports one tile with exponential backoff and jitter between attempts.
+
+    The client writes to a ``.part`` file that is renamed only after it
+    opens as a raster, so an interrupted run never leaves a tile that
+    looks finished.
+    """
+    part_path = output_path + '.part.tif'
+
+    for attempt in range(retries + 1):
+        try:
+            client.export_tile(tile.bounds, crs, scale, part_path)
+            if not is_complete(part_path):
+                raise RuntimeError(f"Повреждённый тайл {part_path}")
+            os.replace(part_path, output_path)
+            return output_path
+        except Exception as e:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt * (1 + random.random())
+            print(f"Тайл {tile.row}/{tile.col}: {e}; повтор через {delay:.1f} с")
+            time.sleep(delay)
+
+
+def download_tiles(client, tiles, crs, scale, tile_dir, workers=4, retries=4, backoff=2.0):
+    """Fetches missing tiles concurrently; tiles already on disk are skipped.
+
+    Returns:
+        tuple: (list of tile paths, list of (tile, error) for failed tiles).
+    """
+    os.makedirs(tile_dir, exist_ok=True)
+
+    paths = []
+    missing = []
+    for tile in tiles:
+        path = tile_path(tile_dir, tile)
+        if is_complete(path):
+            paths.append(path)
+        else:
+            missing.append((tile, path))
+
+    print(f"Тайлов: {len(tiles)}, уже скачано: {len(paths)}, осталось: {len(missing)}")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_tile, client, tile, crs, scale, path, retries, backoff): tile
+                   for tile, path in missing}
+        for future in as_completed(futures):
+            tile = futures[future]
+            try:
+                paths.append(future.result())
+            except Exception as e:
+                failed.append((tile, e))
+                print(f"Не удалось скачать тайл {tile.row}/{tile.col}: {e}")
+
+    return sorted(paths), failed
+
+
+def write_vrt(paths, output_path):
+    """Writes a VRT mosaic of tiles that share CRS, resolution, bands and dtype."""
+    with rasterio.open(paths[0]) as src:
+        crs, res, count, dtype = src.crs, src.res, src.count, src.dtypes[0]
+        nodata = src.nodata
+
+    sources = []
+    left, bottom, right, top = math.inf, math.inf, -math.inf, -math.inf
+    for path in paths:
+        with rasterio.open(path) as src:
+            sources.append((path, src.bounds, src.width, src.height))
+            left, bottom = min(left, src.bounds.left), min(bottom, src.bounds.bottom)
+            right, top = max(right, src.bounds.right), max(top, src.bounds.top)
+
+    width = round((right - left) / res[0])
+    height = round((top - bottom) / res[1])
+    vrt_dir = os.path.dirname(os.path.abspath(output_path))
+    data_type = {'uint8': 'Byte', 'uint16': 'UInt16', 'int16': 'Int16', 'uint32': 'UInt32',
+                 'int32': 'Int32', 'float32': 'Float32', 'float64': 'Float64'}[dtype]
+
+    lines = [f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">',
+             f'  <SRS>{escape(crs.to_wkt())}</SRS>',
+             f'  <GeoTransform>{left}, {res[0]}, 0, {top}, 0, {-res[1]}</GeoTransform>']
+    for band in range(1, count + 1):
+        lines.append(f'  <VRTRasterBand dataType="{data_type}" band="{band}">')
+        if nodata is not None:
+            lines.append(f'    <NoDataValue>{nodata}</NoDataValue>')
+        for path, bounds, w, h in sources:
+            x_off = round((bounds.left - left) / res[0])
+            y_off = round((top - bounds.top) / res[1])
+            lines += [
+                '    <SimpleSource>',
+                f'      <SourceFilename relativeToVRT="1">{escape(os.path.relpath(path, vrt_dir))}</SourceFilename>',
+                f'      <SourceBand>{band}</SourceBand>',
+                f'      <SrcRect xOff="0" yOff="0" xSize="{w}" ySize="{h}"/>',
+                f'      <DstRect xOff="{x_off}" yOff="{y_off}" xSize="{w}" ySize="{h}"/>',
+                '    </SimpleSource>',
+            ]
+        lines.append('  </VRTRasterBand>')
+    lines.append('</VRTDataset>')
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return output_path
+
+
+def mosaic_tiles(paths, output_path):
+    """Joins tiles into a VRT (by extension) or a tiled, compressed GeoTIFF."""
+    if output_path.lower().endswith('.vrt'):
+        return write_vrt(paths, output_path)
+
+    merge(paths, dst_path=output_path,
+          dst_kwds={'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+                    'compress': 'deflate', 'BIGTIFF': 'IF_SAFER'})
+    return output_path
+
+
+def export_aoi(bounds, output_path, client=None, tile_size_m=10_000, scale=10, workers=4,
+               retries=4, backoff=2.0, tile_dir=None):
+    """Exports a lon/lat AOI as a grid of tiles and mosaics them.
+
+    ``client`` needs ``export_tile(bounds, crs, scale, output_file)``. By
+    default it is ``download.EarthEngineClient``. Tiles are exported in
+    the AOI's UTM zone and kept in ``tile_dir``, so a rerun fetches only
+    the tiles that are still missing.
+
+    Returns:
+        str: Path of the mosaic, or None if some tiles failed.
+    """
+    if client is None:
+        from download import EarthEngineClient
+
+        client = EarthEngineClient()
+
+    crs = utm_crs((bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2)
+    tiles = split_aoi(transform_bounds('EPSG:4326', crs, *bounds), crs, tile_size_m, scale)
+    tile_dir = tile_dir or os.path.splitext(output_path)[0] + '_tiles'
+
+    paths, failed = download_tiles(client, tiles, crs, scale, tile_dir,
+                                   workers=workers, retries=retries, backoff=backoff)
+    if failed:
+        print(f"Не скачано тайлов: {len(failed)}; перезапустите, чтобы докачать")
+        return None
+
+    mosaic_tiles(paths, output_path)
+    print(f"Успешно сохранено: {os.path.abspath(output_path)}")
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Потайловый экспорт снимка Sentinel-2 для большой области")
+    parser.add_argument('--bounds', type=float, nargs=4, required=True,
+                        metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'))
+    parser.add_argument('--output', default='sentinel_rgb_10m_aoi.tif',
+                        help="GeoTIFF или .vrt")
+    parser.add_argument('--tile-size', type=int, default=10_000, help="Размер тайла, м")
+    parser.add_argument('--scale', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--retries', type=int, default=4)
+    args = parser.parse_args()
+
+    export_aoi(args.bounds, args.output, tile_size_m=args.tile_size, scale=args.scale,
+               workers=args.workers, retries=args.retries)
@@ -0,0 +1,309 @@
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import rasterio
+import shapely
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.features import rasterize
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, transform_bounds
+
+from cache import StageCache
+from vector_io import read_layer
+from visualize import scene_stretch_limits
+
+TILE_SIZE = 256
+ORIGIN = 20037508.342789244
+WEB_MERCATOR = 'EPSG:3857'
+LAYERS = ('rgb', 'crops')
+
+OVERLAY_FILL = (255, 0, 0, 89)
+OVERLAY_EDGE = (255, 0, 0, 255)
+
+
+def tile_bounds(x, y, z):
+    size = 2 * ORIGIN / 2 ** z
+    left = -ORIGIN + x * size
+    top = ORIGIN - y * size
+    return left, top - size, left + size, top
+
+
+def tiles_for_bounds(bounds, z):
+    """XYZ tiles at zoom ``z`` that cover Web Mercator ``bounds``."""
+    size = 2 * ORIGIN / 2 ** z
+    last = 2 ** z - 1
+    x0 = min(max(int((bounds[0] + ORIGIN) // size), 0), last)
+    x1 = min(max(int(math.ceil((bounds[2] + ORIGIN) / size)) - 1, x0), last)
+    y0 = min(max(int((ORIGIN - bounds[3]) // size), 0), last)
+    y1 = min(max(int(math.ceil((ORIGIN - bounds[1]) / size)) - 1, y0), last)
+    return {(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)}
+
+
+def tile_path(layer_dir, x, y, z):
+    return os.path.join(layer_dir, str(z), str(x), f"{y}.png")
+
+
+def native_zoom(src):
+    """Smallest zoom whose Web Mercator pixel is no larger than the scene's."""
+    transform, _, _ = calculate_default_transform(
+        src.crs, WEB_MERCATOR, src.width, src.height, *src.bounds)
+    return max(0, math.ceil(math.log2(2 * ORIGIN / TILE_SIZE / transform.a)))
+
+
+def geometry_index(geojson_path):
+    """Reads polygons in Web Mercator with a hash and bounds per geometry."""
+    gdf = read_layer(geojson_path)
+    if gdf.empty:
+        return np.empty(0, dtype=object), {}
+    geometries = gdf.to_crs(WEB_MERCATOR).geometry.to_numpy()
+
+    keys = [hashlib.sha1(wkb).hexdigest() for wkb in shapely.to_wkb(geometries)]
+    bounds = shapely.bounds(geometries).tolist()
+    return geometries, dict(zip(keys, bounds))
+
+
+def save_tile(rgba, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    Image.fromarray(rgba, 'RGBA').save(tmp_path, 'PNG')
+    os.replace(tmp_path, path)
+
+
+def remove_tile(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+_worker = {}
+
+
+def _init_worker(image_path, geojson_path, limits):
+    _worker['src'] = rasterio.open(image_path)
+    _worker['limits'] = limits
+    if geojson_path is not None:
+        geometries, _ = geometry_index(geojson_path)
+        _worker['geometries'] = geometries
+        _worker['tree'] = shapely.STRtree(geometries)
+
+
+def render_rgb_tile(src, x, y, z, limits):
+    transform = from_bounds(*tile_bounds(x, y, z), TILE_SIZE, TILE_SIZE)
+    with WarpedVRT(src, crs=WEB_MERCATOR, transform=transform, width=TILE_SIZE, height=TILE_SIZE,
+                   resampling=Resampling.bilinear, add_alpha=True) as vrt:
+        data = vrt.read([1, 2, 3, vrt.count])
+
+    if not data[3].any():
+        return None
+
+    lower, upper = limits
+    rgb = np.clip((data[:3].astype(np.float32) - lower) / max(upper - lower, 1e-6), 0, 1)
+    rgba = np.empty((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    rgba[..., :3] = np.moveaxis(rgb * 255, 0, -1).round()
+    rgba[..., 3] = data[3]
+    return rgba
+
+
+def render_overlay_tile(geometries, tree, x, y, z):
+    bounds = tile_bounds(x, y, z)
+    hits = tree.query(shapely.box(*bounds))
+    if len(hits) == 0:
+        return None
+
+    transform = from_bounds(*bounds, TILE_SIZE, TILE_SIZE)
+    fill = rasterize(geometries[hits], (TILE_SIZE, TILE_SIZE), transform=transform, dtype=np.uint8)
+    edge = rasterize(shapely.boundary(geometries[hits]), (TILE_SIZE, TILE_SIZE),
+                     transform=transform, dtype=np.uint8)
+    if not fill.any() and not edge.any():
+        return None
+
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    rgba[fill > 0] = OVERLAY_FILL
+    rgba[edge > 0] = OVERLAY_EDGE
+    return rgba
+
+
+def _render_tiles(layer, layer_dir, z, tiles):
+    written = 0
+    for x, y in tiles:
+        if layer == 'rgb':
+            rgba = render_rgb_tile(_worker['src'], x, y, z, _worker['limits'])
+        else:
+            rgba = render_overlay_tile(_worker['geometries'], _worker['tree'], x, y, z)
+
+        path = tile_path(layer_dir, x, y, z)
+        if rgba is None:
+            remove_tile(path)
+        else:
+            save_tile(rgba, path)
+            written += 1
+    return written
+
+
+def _build_overviews(layer_dir, z, tiles):
+    """Builds zoom ``z`` tiles by 2x2-averaging their children at ``z + 1``.
+
+    Averaging is done on premultiplied alpha, so transparent pixels do not
+    darken the edges of the scene or the overlay.
+    """
+    written = 0
+    for x, y in tiles:
+        canvas = Image.new('RGBa', (TILE_SIZE * 2, TILE_SIZE * 2))
+        found = False
+        for dx in (0, 1):
+            for dy in (0, 1):
+                child = tile_path(layer_dir, 2 * x + dx, 2 * y + dy, z + 1)
+                if os.path.exists(child):
+                    with Image.open(child) as img:
+                        canvas.paste(img.convert('RGBA').convert('RGBa'), (dx * TILE_SIZE, dy * TILE_SIZE))
+                    found = True
+
+        path = tile_path(layer_dir, x, y, z)
+        if not found:
+            remove_tile(path)
+            continue
+        save_tile(np.asarray(canvas.reduce(2).convert('RGBA')), path)
+        written += 1
+    return written
+
+
+def _chunks(tiles, size):
+    tiles = sorted(tiles)
+    return [tiles[i:i + size] for i in range(0, len(tiles), size)]
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    tmp_path = os.path.join(output_dir, 'manifest.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(output_dir, 'manifest.json'))
+
+
+def write_tilejson(layer_dir, layer, lonlat_bounds, min_zoom, max_zoom, url=None):
+    tilejson = {
+        'tilejson': '3.0.0',
+        'name': layer,
+        'tiles': [url or '{z}/{x}/{y}.png'],
+        'minzoom': min_zoom,
+        'maxzoom': max_zoom,
+        'bounds': list(lonlat_bounds),
+    }
+    with open(os.path.join(layer_dir, 'tiles.json'), 'w', encoding='utf-8') as f:
+        json.dump(tilejson, f, indent=2)
+
+
+def generate_tiles(image_path, output_dir, geojson_path=None, min_zoom=None, max_zoom=None, workers=None,
+                   chunk_size=32, cache=None):
+    """Writes XYZ PNG pyramids for the scene ('rgb') and the crop overlay ('crops').
+
+    Tiles at ``max_zoom`` (the scene's native zoom by default) are rendered
+    from the sources in a process pool; lower zooms are built from their
+    children. ``manifest.json`` records the scene digest and the hash and
+    bounds of every polygon, so a rerun only renders tiles whose inputs
+    changed: all scene tiles if the scene changed, and for the overlay only
+    tiles touched by added or removed polygons. The scene digest comes from
+    ``cache`` (a ``StageCache``, by default one in ``output_dir/.cache``),
+    which remembers it while the file is unchanged.
+
+    Returns:
+        dict: Number of written tiles per layer.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    cache = cache or StageCache(os.path.join(output_dir, '.cache'))
+
+    with rasterio.open(image_path) as src:
+        max_zoom = native_zoom(src) if max_zoom is None else max_zoom
+        mercator_bounds = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+        lonlat_bounds = transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+        limits = scene_stretch_limits(src)
+
+    if min_zoom is None:
+        min_zoom = max_zoom
+        while min_zoom > 0 and len(tiles_for_bounds(mercator_bounds, min_zoom)) > 1:
+            min_zoom -= 1
+
+    zooms = {'min_zoom': min_zoom, 'max_zoom': max_zoom}
+    dirty = {}
+
+    rgb_state = {'source': cache.file_digest(image_path), 'limits': list(limits), **zooms}
+    if manifest.get('rgb') != rgb_state:
+        shutil.rmtree(os.path.join(output_dir, 'rgb'), ignore_errors=True)
+        dirty['rgb'] = tiles_for_bounds(mercator_bounds, max_zoom)
+    else:
+        dirty['rgb'] = {(x, y) for x, y in tiles_for_bounds(mercator_bounds, max_zoom)
+                        if not os.path.exists(tile_path(os.path.join(output_dir, 'rgb'), x, y, max_zoom))}
+
+    crops_state = None
+    if geojson_path is not None:
+        _, geometry_bounds = geometry_index(geojson_path)
+        previous = manifest.get('crops', {})
+        if {k: previous.get(k) for k in zooms} != zooms:
+            shutil.rmtree(os.path.join(output_dir, 'crops'), ignore_errors=True)
+            changed = list(geometry_bounds.values())
+        else:
+            old_bounds = previous.get('geometries', {})
+            changed = [bounds for key, bounds in geometry_bounds.items() if key not in old_bounds]
+            changed += [bounds for key, bounds in old_bounds.items() if key not in geometry_bounds]
+
+        dirty['crops'] = set()
+        for bounds in changed:
+            dirty['crops'] |= tiles_for_bounds(bounds, max_zoom)
+        crops_state = {'geometries': geometry_bounds, **zooms}
+
+    written = {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(image_path, geojson_path, limits)) as pool:
+        for layer, tiles in dirty.items():
+            layer_dir = os.path.join(output_dir, layer)
+            written[layer] = sum(pool.map(
+                _render_tiles, repeat(layer), repeat(layer_dir), repeat(max_zoom),
+                _chunks(tiles, chunk_size)))
+
+            for z in range(max_zoom - 1, min_zoom - 1, -1):
+                tiles = {(x // 2, y // 2) for x, y in tiles}
+                written[layer] += sum(pool.map(
+                    _build_overviews, repeat(layer_dir), repeat(z), _chunks(tiles, chunk_size)))
+
+            os.makedirs(layer_dir, exist_ok=True)
+            write_tilejson(layer_dir, layer, lonlat_bounds, min_zoom, max_zoom)
+            print(f"Слой {layer}: обновлено тайлов {written[layer]}, зум {min_zoom}-{max_zoom}")
+
+    manifest['rgb'] = rgb_state
+    if crops_state is not None:
+        manifest['crops'] = crops_state
+    save_manifest(output_dir, manifest)
+
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Генерация XYZ-тайлов снимка и слоя сегментации")
+    parser.add_argument('--image', default="sentinel_rgb_10m_5000_voronezh.tif")
+    parser.add_argument('--geojson', default="crops_final.geojson")
+    parser.add_argument('--output-dir', default="tiles/voronezh")
+    parser.add_argument('--min-zoom', type=int, default=None)
+    parser.add_argument('--max-zoom', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    generate_tiles(args.image, args.output_dir, args.geojson if os.path.exists(args.geojson) else None,
+                   min_zoom=args.min_zoom, max_zoom=args.max_zoom, workers=args.workers)
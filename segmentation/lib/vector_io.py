@@ -0,0 +1,50 @@
+import os
+
+import geopandas as gpd
+import shapely
+
+FORMATS = {
+    '.geojson': 'GeoJSON',
+    '.json': 'GeoJSON',
+    '.fgb': 'FlatGeobuf',
+    '.parquet': 'GeoParquet',
+    '.geoparquet': 'GeoParquet',
+}
+
+
+def layer_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unknown vector format: {ext}, expected one of {sorted(FORMATS)}")
+    return FORMATS[ext]
+
+
+def write_layer(gdf, path):
+    """Writes a layer in the format given by the file extension.
+
+    GeoParquet gets a bbox covering column and FlatGeobuf its packed
+    R-tree, so ``read_layer(path, bbox=...)`` can skip the rest of the file.
+    """
+    fmt = layer_format(path)
+    if fmt == 'GeoParquet':
+        gdf.to_parquet(path, write_covering_bbox=True)
+    elif fmt == 'FlatGeobuf':
+        gdf.to_file(path, driver='FlatGeobuf', SPATIAL_INDEX='YES')
+    else:
+        gdf.to_file(path, driver='GeoJSON')
+    return path
+
+
+def read_layer(path, bbox=None):
+    """Reads a layer, optionally only the features intersecting ``bbox`` (in the layer CRS).
+
+    GeoParquet filters row groups on the bbox covering column, FlatGeobuf
+    uses its spatial index, GeoJSON has to scan the whole file.
+    """
+    if layer_format(path) == 'GeoParquet':
+        gdf = gpd.read_parquet(path, bbox=bbox)
+        if bbox is not None:
+            # The covering column only compares bounding boxes.
+            gdf = gdf[gdf.intersects(shapely.box(*bbox))]
+        return gdf
+    return gpd.read_file(path, bbox=bbox)
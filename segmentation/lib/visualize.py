@@ -1,32 +1,174 @@
 import rasterio
+from rasterio.enums import Resampling
+from rasterio.features import rasterize
 from rasterio.plot import show
-import geopandas as gpd
+from rasterio.transform import Affine
+from rasterio.windows import Window
+import cv2
 import matplotlib.pyplot as plt
 import numpy as np
+import shapely
+from PIL import Image
 
+from vector_io import read_layer
 
-def normalize_image(img_data):
-    img_data = np.nan_to_num(img_data)
 
-    lower = np.percentile(img_data, 2)
-    upper = np.percentile(img_data, 98)
+def histogram_percentiles(counts, percentiles, offset=0):
+    """Percentiles of integer data from its histogram, interpolated like ``np.percentile``."""
+    cumulative = np.cumsum(counts)
+    n = cumulative[-1]
+
+    values = []
+    for q in percentiles:
+        rank = q / 100 * (n - 1)
+        below = np.searchsorted(cumulative, np.floor(rank), side='right')
+        above = np.searchsorted(cumulative, np.ceil(rank), side='right')
+        values.append(offset + below + (rank - np.floor(rank)) * (above - below))
+    return values
+
+
+def percentile_limits(img_data, lower=2, upper=98, max_samples=1_000_000, chunk_rows=512):
+    """Estimates the stretch limits without copying the whole image.
+
+    8/16-bit data is counted into a histogram chunk by chunk, which gives
+    the exact ``np.percentile`` values. Float data is sampled on a regular
+    grid of at most ``max_samples`` pixels, with NaN counted as 0 as in
+    ``np.nan_to_num``.
+    """
+    if img_data.dtype in (np.uint8, np.uint16):
+        counts = np.zeros(np.iinfo(img_data.dtype).max + 1, dtype=np.int64)
+        for y in range(0, img_data.shape[0], chunk_rows):
+            counts += np.bincount(img_data[y:y + chunk_rows].ravel(), minlength=len(counts))
+        return histogram_percentiles(counts, (lower, upper))
+
+    step = max(1, int(np.sqrt(img_data.shape[0] * img_data.shape[1] / max_samples)))
+    sample = np.nan_to_num(img_data[::step, ::step].astype(np.float64))
+    return np.percentile(sample, lower), np.percentile(sample, upper)
+
+
+def apply_stretch(img_data, lower, upper, out=None, chunk_rows=512):
+    """Clips to [lower, upper] and scales to [0, 1] chunk by chunk into ``out``.
+
+    ``out`` may be ``img_data`` itself for float input. Only one chunk of
+    temporaries exists at a time.
+    """
+    if out is None:
+        out = np.empty(img_data.shape, dtype=np.float32)
 
     if upper == lower:
-        return np.zeros_like(img_data)
+        out[...] = 0
+        return out
+
+    scale = 1 / (upper - lower)
+    for y in range(0, img_data.shape[0], chunk_rows):
+        chunk = out[y:y + chunk_rows]
+        if out is not img_data:
+            chunk[...] = img_data[y:y + chunk_rows]
+        np.nan_to_num(chunk, copy=False)
+        np.clip(chunk, lower, upper, out=chunk)
+        chunk -= lower
+        chunk *= scale
+    return out
+
+
+def normalize_image(img_data, lower=2, upper=98, out=None):
+    lower_value, upper_value = percentile_limits(img_data, lower, upper)
+    return apply_stretch(img_data, lower_value, upper_value, out=out)
+
+
+def scene_stretch_limits(src, indexes=(1, 2, 3), lower=2, upper=98, max_size=2048):
+    """Stretch limits of a whole scene from a nearest-neighbour decimated read.
+
+    Shared by the PNG overlay and the XYZ tiles so both get the same
+    contrast; averaging would narrow the histogram.
+    """
+    factor = max(1, max(src.width, src.height) / max_size)
+    overview = src.read(list(indexes), out_shape=(
+        len(indexes), max(1, round(src.height / factor)), max(1, round(src.width / factor))),
+        resampling=Resampling.nearest)
+    return percentile_limits(np.moveaxis(overview, 0, -1), lower, upper)
+
+
+def read_normalized(src, indexes=(1, 2, 3), max_size=2048, chunk_rows=512, scale=1.0):
+    """Reads bands into one (H, W, C) float32 buffer and stretches it in place.
+
+    Limits come from a decimated overview-level read of at most
+    ``max_size`` pixels per side, so the full-resolution data is never
+    sorted and no full-size temporaries are made. ``scale`` < 1 reads a
+    downsampled image in one pass for previews.
+    """
+    lower, upper = scene_stretch_limits(src, indexes, max_size=max_size)
+
+    if scale != 1:
+        out_h, out_w = max(1, round(src.height * scale)), max(1, round(src.width * scale))
+        data = src.read(list(indexes), out_shape=(len(indexes), out_h, out_w))
+        out = np.moveaxis(data, 0, -1).astype(np.float32)
+        del data
+        return apply_stretch(out, lower, upper, out=out, chunk_rows=chunk_rows)
+
+    out = np.empty((src.height, src.width, len(indexes)), dtype=np.float32)
+    for y in range(0, src.height, chunk_rows):
+        rows = min(chunk_rows, src.height - y)
+        data = src.read(list(indexes), window=Window(0, y, src.width, rows))
+        out[y:y + rows] = np.moveaxis(data, 0, -1)
+
+    return apply_stretch(out, lower, upper, out=out, chunk_rows=chunk_rows)
+
+
+def burn_polygons(rgb, geometries, transform, color=(255, 0, 0), alpha=0.35, edge_width=1):
+    """Alpha-blends filled polygons and opaque outlines into a uint8 RGB array in place.
+
+    Polygons are simplified to half a pixel and burned with one
+    ``rasterize`` call; outlines are the fill minus its erosion. The cost
+    depends on the pixel count, not on the number of polygons.
+    """
+    geometries = shapely.simplify(geometries, abs(transform.a) / 2)
+    fill = rasterize(geometries, rgb.shape[:2], transform=transform, dtype=np.uint8)
+    kernel = np.ones((2 * edge_width + 1, 2 * edge_width + 1), np.uint8)
+    edge = fill > cv2.erode(fill, kernel, borderType=cv2.BORDER_REPLICATE)
+    fill = fill.astype(bool)
+
+    color = np.asarray(color, dtype=np.float32)
+    rgb[fill] = (rgb[fill] * (1 - alpha) + color * alpha).round().astype(np.uint8)
+    rgb[edge] = color.astype(np.uint8)
+    return rgb
+
+
+def render_overlay(tiff_path, geojson_path, output_png_path, scale=1.0, color=(255, 0, 0), alpha=0.35,
+                   edge_width=1):
+    """Writes the scene with burned-in polygons straight to a PNG, one pixel per scene pixel.
+
+    ``scale`` < 1 renders a downsampled preview.
+    """
+    with rasterio.open(tiff_path) as src:
+        img = read_normalized(src, scale=scale)
+        transform = src.transform * Affine.scale(src.width / img.shape[1], src.height / img.shape[0])
+        image_crs = src.crs
+
+    img *= 255
+    rgb = img.round().astype(np.uint8)
+    del img
+
+    gdf = read_layer(geojson_path)
+    if not gdf.empty:
+        if gdf.crs is None:
+            gdf.set_crs(image_crs, inplace=True)
+        elif gdf.crs != image_crs:
+            gdf = gdf.to_crs(image_crs)
+        burn_polygons(rgb, gdf.geometry.to_numpy(), transform, color, alpha, edge_width)
 
-    img_data = np.clip(img_data, lower, upper)
-    img_data = (img_data - lower) / (upper - lower)
-    return img_data
+    Image.fromarray(rgb).save(output_png_path)
+    print(f"Сохранено: {output_png_path} ({len(gdf)} зон)")
+    return output_png_path
 
 
-def visualize_overlay_filled(tiff_path, geojson_path, output_png_path):
+def visualize_overlay_filled(tiff_path, geojson_path, output_png_path, mode='matplotlib', scale=1.0):
+    if mode == 'raster':
+        return render_overlay(tiff_path, geojson_path, output_png_path, scale=scale)
 
     try:
         with rasterio.open(tiff_path) as src:
-            img = src.read([1, 2, 3])
-
-            img_display = np.moveaxis(img, 0, -1)
-            img_display = normalize_image(img_display)
+            img_display = read_normalized(src)
 
             extent = [src.bounds.left, src.bounds.right,
                       src.bounds.bottom, src.bounds.top]
@@ -37,7 +179,7 @@ def visualize_overlay_filled(tiff_path, geojson_path, output_png_path):
         return
 
     try:
-        gdf = gpd.read_file(geojson_path)
+        gdf = read_layer(geojson_path)
 
         if not gdf.empty:
             if gdf.crs is None:
@@ -0,0 +1,82 @@
+import argparse
+import os
+
+import torch
+import segmentation_models_pytorch as smp
+
+
+def build_inference_model(checkpoint_path):
+    """Rebuilds the U-Net with the sigmoid head used at inference time.
+
+    Training runs with ``activation=None`` and a logits loss. The saved
+    state dict has no activation parameters, so the same weights load into
+    the sigmoid model that ``lib/predict.py`` expects.
+    """
+    model = smp.Unet(encoder_name="resnet34", encoder_weights=None, classes=1,
+                     activation='sigmoid')
+    model.load_state_dict(torch.load(checkpoint_path, map_location='cpu'))
+    model.eval()
+    return model
+
+
+def export_torchscript(model, output_path, patch_size=64):
+    example = torch.zeros(1, 3, patch_size, patch_size)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced)
+
+    frozen.save(output_path)
+    return output_path
+
+
+def export_onnx(model, output_path, patch_size=64, opset=17):
+    """Exports with dynamic batch, height and width, so any patch_size divisible by 32 runs."""
+    example = torch.zeros(1, 3, patch_size, patch_size)
+
+    torch.onnx.export(
+        model,
+        example,
+        output_path,
+        input_names=['image'],
+        output_names=['probability'],
+        dynamic_axes={'image': {0: 'batch', 2: 'height', 3: 'width'},
+                      'probability': {0: 'batch', 2: 'height', 3: 'width'}},
+        opset_version=opset,
+        dynamo=False,
+    )
+    return output_path
+
+
+def export_model(checkpoint_path, output_dir=None, patch_size=64, formats=('torchscript', 'onnx')):
+    model = build_inference_model(checkpoint_path)
+
+    output_dir = output_dir or os.path.dirname(checkpoint_path)
+    stem = os.path.splitext(os.path.basename(checkpoint_path))[0]
+
+    exported = {}
+    if 'torchscript' in formats:
+        exported['torchscript'] = export_torchscript(
+            model, os.path.join(output_dir, f"{stem}.pt"), patch_size)
+    if 'onnx' in formats:
+        exported['onnx'] = export_onnx(
+            model, os.path.join(output_dir, f"{stem}.onnx"), patch_size)
+
+    for fmt, path in exported.items():
+        print(f"Экспорт {fmt}: {path}")
+    return exported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Экспорт U-Net в TorchScript/ONNX для инференса")
+    parser.add_argument('checkpoint', nargs='?',
+                        default='checkpoints/best_model.pth')
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--patch-size', type=int, default=64)
+    parser.add_argument('--formats', nargs='+',
+                        default=['torchscript', 'onnx'])
+    args = parser.parse_args()
+
+    export_model(args.checkpoint, args.output_dir,
+                 args.patch_size, tuple(args.formats))
@@ -9,6 +9,8 @@ from albumentations.pytorch import ToTensorV2
 from sklearn.model_selection import train_test_split
 import glob
 
+from export import export_model
+
 DATA_DIR = '/Users/dborovinsky/Downloads/EuroSAT_RGB'
 CLASSES = ['AnnualCrop', 'Forest', 'HerbaceousVegetation', 'Highway', 'Industrial',
            'Pasture', 'PermanentCrop', 'Residential', 'River', 'SeaLake']
@@ -197,3 +199,5 @@ if __name__ == '__main__':
 
             combined = np.hstack([img_vis, true_mask_vis, pred_mask_vis])
             cv2.imwrite(f'debug_images/epoch_{epoch+1}.jpg', combined)
+
+    export_model('checkpoints/best_model.pth')